@@ -1,5 +1,32 @@
-from .contextwords import *
-from .focmodels import *
-from .load import *
-from .sample import *
-from .utils import *
+import importlib
+
+# Public names and the submodule they live in: submodules (and their heavy dependencies)
+# are only imported when one of their names is first accessed.
+_lazy = {
+    'approx' : ['approxColloc'],
+    'contextwords' : ['listContextwords'],
+    'focmodels' : ['createBow', 'createRel', 'createPath', 'tokensFromMacro'],
+    'load' : ['loadVocab', 'loadMacro', 'loadColloc', 'loadFocRegisters', 'loadStudyRegisters',
+              'updateVocab', 'updateColloc'],
+    'plan' : ['planGrid'],
+    'sample' : ['sampleTypes'],
+    'socmodels' : ['targetPPMI', 'weightTokens', 'createSoc', 'tokenDistances', 'loadVectors'],
+    'utils' : ['booleanize', 'castMatrix', 'reduceDimensions', 'mergeMatrices', 'matrixFingerprint',
+               'listCws', 'countCws', 'plotPatterns', 'fullMerge']
+}
+_origin = {name : module for module, names in _lazy.items() for name in names}
+
+__all__ = list(_origin.keys())
+
+def __getattr__(name):
+    if name in _origin:
+        value = getattr(importlib.import_module(f".{_origin[name]}", __name__), name)
+    elif name in _lazy or name in ['benchmark', 'parsing', 'pipeline', 'profiling']:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,210 @@
+import re
+import math
+import zlib
+import numpy as np
+from scipy import sparse
+from tqdm import tqdm
+import logging
+
+from nephosem import TypeTokenMatrix
+
+from .parsing import LineParser
+
+__all__ = ['CountMinSketch', 'ApproxColloc', 'approxColloc']
+
+class CountMinSketch:
+    """Approximate counts in fixed memory.
+
+    Estimates are never below the true counts and, with probability `1 - delta`,
+    exceed them by at most `epsilon` times the total of all counts.
+
+    Parameters
+    ----------
+    epsilon : float, default=1e-5
+        Relative error bound; the width of the table is `e / epsilon`.
+    delta : float, default=1e-3
+        Probability of exceeding the error bound; the depth of the table is `ln(1 / delta)`.
+    seed : int, default=0
+        Seed of the hash functions.
+    """
+    def __init__(self, epsilon = 1e-5, delta = 1e-3, seed = 0):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.salts = [zlib.crc32(f"{seed}-{i}".encode("utf-8")) for i in range(self.depth)]
+        self.table = np.zeros((self.depth, self.width), dtype = np.int64)
+        self.total = 0
+
+    def _cells(self, item):
+        key = item.encode("utf-8")
+        return [zlib.crc32(key, salt) % self.width for salt in self.salts]
+
+    def add(self, item, count = 1):
+        for row, col in enumerate(self._cells(item)):
+            self.table[row, col] += count
+        self.total += count
+
+    def update(self, counts):
+        """Add the counts of many items at once.
+
+        Parameters
+        ----------
+        counts : dict
+            Items as keys and their counts as values, e.g. aggregated over a file.
+        """
+        if len(counts) == 0:
+            return
+        values = np.fromiter(counts.values(), dtype = np.int64, count = len(counts))
+        cells = np.array([self._cells(item) for item in counts], dtype = np.int64) # items x depth
+        for row in range(self.depth):
+            np.add.at(self.table[row], cells[:, row], values)
+        self.total += int(values.sum())
+
+    def __getitem__(self, item):
+        return int(min(self.table[row, col] for row, col in enumerate(self._cells(item))))
+
+    @property
+    def error(self):
+        """Maximum overestimation of any count (with probability `1 - delta`)."""
+        return self.epsilon * self.total
+
+class ApproxColloc:
+    """Co-occurrence counts of a few target types, with approximate marginals of their context words.
+
+    It can be given as a value of `collocs` in :func:`~semasioFlow.socmodels.targetPPMI`
+    instead of a full collocation matrix. Created with :func:`approxColloc`.
+
+    Parameters
+    ----------
+    counts : :class:`~nephosem.TypeTokenMatrix`
+        Exact co-occurrence frequencies of the targets (rows) with their context words (columns).
+    nfreq : dict
+        Exact marginal frequencies of the targets as nodes.
+    cfreq : :class:`CountMinSketch`
+        Approximate marginal frequencies of all types as context words.
+    total : int
+        Total number of co-occurrences in the corpus.
+    """
+    def __init__(self, counts, nfreq, cfreq, total):
+        self.counts = counts
+        self.nfreq = nfreq
+        self.cfreq = cfreq
+        self.total = total
+
+    def association(self, targets):
+        """Compute PMI values of targets with their context words.
+
+        Parameters
+        ----------
+        targets : list of str
+
+        Returns
+        -------
+        tuple of :class:`~nephosem.TypeTokenMatrix`
+            The raw co-occurrence frequencies, the PMI values and the maximum error of the PMI values,
+            with target(s) as rows and context words as columns. The error holds with probability `1 - delta`;
+            since the marginals are overestimated, PMI values can only be underestimated.
+        """
+        subcolloc = self.counts.submatrix(row = targets).drop(axis = 1, n_nonzero = 0)
+        observed = sparse.coo_matrix(subcolloc.matrix)
+        rows = np.array([self.nfreq[x] for x in subcolloc.row_items], dtype = np.float64)
+        cols = np.array([self.cfreq[x] for x in subcolloc.col_items], dtype = np.float64)
+        o = observed.data.astype(np.float64)
+        c = cols[observed.col]
+        pmi = np.log(o * self.total / (rows[observed.row] * c))
+        # the true marginal lies between max(o, c - error) and c
+        lower = np.maximum(o, c - self.cfreq.error)
+        error = np.log(c / lower)
+        shape = observed.shape
+        def asMatrix(values):
+            values = sparse.csr_matrix((values, (observed.row, observed.col)), shape = shape)
+            return TypeTokenMatrix(values, subcolloc.row_items, subcolloc.col_items)
+        return (subcolloc, asMatrix(pmi), asMatrix(error))
+
+def approxColloc(targets, settings, fnames = None, epsilon = 1e-5, delta = 1e-3, seed = 0):
+    """Count co-occurrences of target types in a single pass over the corpus.
+
+    Only the rows of the targets are counted exactly; the marginal frequencies of
+    the context words are kept in a :class:`CountMinSketch`, so that memory does not
+    depend on the size of the vocabulary.
+
+    Parameters
+    ----------
+    targets : list of str
+        Target types, in the format of `settings['type']`.
+    settings : dict
+        Configuration settings as designed from the `nephosem` workflow, including
+        'left-span', 'right-span' and, optionally, 'separator-line-machine' to stop windows
+        at sentence boundaries. Context words follow the format of `settings['colloc']`.
+    fnames : str or list, optional
+        Path to list of filenames or list of filenames to count. Default is the full corpus.
+    epsilon : float, default=1e-5
+        Relative error bound of the marginal frequencies, see :class:`CountMinSketch`.
+    delta : float, default=1e-3
+        Probability of exceeding the error bound.
+    seed : int, default=0
+        Seed of the hash functions.
+
+    Returns
+    -------
+    :class:`ApproxColloc`
+    """
+    from .load import _listFnames
+
+    parser = LineParser(settings)
+    colloc_format = settings.get('colloc', settings['type'])
+    separator = settings.get('separator-line-machine')
+    separator = re.compile(separator) if separator else None
+    left, right = settings['left-span'], settings['right-span']
+    targets = set(targets)
+    counts = {}
+    nfreq = {t : 0 for t in targets}
+    cfreq = CountMinSketch(epsilon, delta, seed)
+    # marginals are aggregated per file and added to the sketch in one go
+    pending = {}
+
+    def countSegment(segment):
+        # segment: list of (type, context word) of a stretch without separators
+        n = len(segment)
+        for j, (node, cw) in enumerate(segment):
+            # number of windows that include position j as context word
+            covered = min(j + left, n - 1) - max(j - right, 0)
+            if covered > 0:
+                pending[cw] = pending.get(cw, 0) + covered
+            if node in targets:
+                window = [segment[i][1] for i in range(max(0, j - left), min(n, j + right + 1)) if i != j]
+                nfreq[node] += len(window)
+                row = counts.setdefault(node, {})
+                for x in window:
+                    row[x] = row.get(x, 0) + 1
+
+    for fname in tqdm(_listFnames(fnames, settings)):
+        segment = []
+        with open(fname, "r", encoding = settings.get('file-encoding', 'utf-8')) as f:
+            for line in f:
+                line = line.strip()
+                if separator and separator.match(line):
+                    countSegment(segment)
+                    segment = []
+                    continue
+                record = parser.parse(line)
+                if record:
+                    segment.append((record.type, parser.format(record, colloc_format)))
+        countSegment(segment)
+        cfreq.update(pending)
+        pending = {}
+
+    rows = sorted(targets)
+    cols = sorted(set(x for row in counts.values() for x in row))
+    col_idx = {x : i for i, x in enumerate(cols)}
+    data, row_ids, col_ids = [], [], []
+    for i, node in enumerate(rows):
+        for x, freq in counts.get(node, {}).items():
+            data.append(freq)
+            row_ids.append(i)
+            col_ids.append(col_idx[x])
+    matrix = sparse.csr_matrix((data, (row_ids, col_ids)), shape = (len(rows), len(cols)), dtype = np.int64)
+    logging.info("Counted %s co-occurrences; marginals within %s with probability %s.",
+                 cfreq.total, cfreq.error, 1 - delta)
+    return ApproxColloc(TypeTokenMatrix(matrix, rows, cols), nfreq, cfreq, cfreq.total)
@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import random
+import platform
+import tracemalloc
+from copy import deepcopy
+from datetime import datetime
+import logging
+
+from .profiling import peakRss
+
+__all__ = ['syntheticCorpus', 'measureStage', 'measureImport', 'checkPrecision', 'runBenchmarks', 'compareBenchmarks']
+
+def syntheticCorpus(output_dir, n_files = 10, sentences_per_file = 50, sentence_length = (5, 20),
+                    vocab_size = 1000, pos_tags = ["N", "V", "A", "R", "P"], zipf = 1.1,
+                    dependencies = False, deprels = ["nsubj", "obj", "amod", "advmod", "case", "conj"],
+                    seed = 0):
+    """Generate a synthetic corpus in the tab-separated format read by `settings['line-machine']`.
+
+    Each file is wrapped in `<artikel>` tags and each sentence in `<s>` and `</s>` lines.
+    Lemma frequencies follow a Zipfian distribution.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory where the corpus files will be stored. If it does not exist it will be created.
+    n_files : int, default=10
+        Number of files to generate.
+    sentences_per_file : int, default=50
+        Number of sentences in each file.
+    sentence_length : tuple of int, default=(5, 20)
+        Minimum and maximum number of tokens per sentence.
+    vocab_size : int, default=1000
+        Number of different lemmas.
+    pos_tags : list of str
+        Part-of-speech tags randomly assigned to the lemmas.
+    zipf : float, default=1.1
+        Exponent of the Zipfian distribution of lemma frequencies.
+    dependencies : bool, default=False
+        Whether to add id, head and dependency relation columns to each line.
+    deprels : list of str
+        Dependency relations randomly assigned to the edges.
+    seed : int, default=0
+        Seed of the random generator, so that the same corpus can be generated again.
+
+    Returns
+    -------
+    tuple
+        The list of file names and a dictionary with the settings needed to read them,
+        to update the `nephosem` settings with.
+    """
+    rng = random.Random(seed)
+    if not os.path.exists(output_dir):
+        logging.info("Creating directory: %s", output_dir)
+        os.makedirs(output_dir)
+
+    lemmas = [(f"lemma{i}", rng.choice(pos_tags)) for i in range(vocab_size)]
+    weights = [1/((i+1)**zipf) for i in range(vocab_size)]
+
+    fnames = []
+    for n in range(n_files):
+        fname = f"{output_dir}/synthetic{n:05d}.conll"
+        lines = [f'<artikel id="{n}">']
+        for _ in range(sentences_per_file):
+            lines.append("<s>")
+            length = rng.randint(*sentence_length)
+            for i, (lemma, pos) in enumerate(rng.choices(lemmas, weights = weights, k = length)):
+                line = f"{lemma}{rng.choice(['', 's'])}\t{pos}\t{lemma}"
+                if dependencies:
+                    head = rng.randint(0, i) if i > 0 else 0
+                    line += f"\t{i+1}\t{head}\t{'ROOT' if head == 0 else rng.choice(deprels)}"
+                lines.append(line)
+            lines.append("</s>")
+        lines.append("</artikel>")
+        with open(fname, "w", encoding = "utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        fnames.append(fname)
+
+    corpus_settings = {
+        'corpus-path' : output_dir,
+        'line-machine' : "([^\t]+)\t([^\t]+)\t([^\t]+)" + ("\t([^\t]+)\t([^\t]+)\t([^\t]+)" if dependencies else ""),
+        'global-columns' : "word,pos,lemma" + (",id,head,deprel" if dependencies else ""),
+        'separator-line-machine' : "^</s>$",
+        'type' : "lemma/pos",
+        'colloc' : "lemma/pos",
+        'token' : "lemma/pos/fid/lid",
+        'file-encoding' : "utf-8"
+    }
+    if dependencies:
+        corpus_settings.update({
+            'node-attr' : "lemma,pos",
+            'edge-attr' : "deprel",
+            'currID' : "id",
+            'headID' : "head"
+        })
+    logging.info("Synthetic corpus of %s files stored in %s.", n_files, output_dir)
+    return (fnames, corpus_settings)
+
+def measureStage(func, *args, trace_memory = True, **kwargs):
+    """Run a function and measure its wall time and memory use.
+
+    The wall time is measured in a run of its own, since :mod:`tracemalloc` slows down
+    allocations; memory is then traced in a second run, on copies of the arguments.
+
+    Parameters
+    ----------
+    func : callable
+    *args, **kwargs
+        Arguments passed on to `func`.
+    trace_memory : bool, default=True
+        Whether to run `func` a second time to trace its memory use.
+
+    Returns
+    -------
+    tuple
+        The output of the timed run of `func` and a dictionary with the wall time in seconds ("wall_time"),
+        the peak of memory traced by :mod:`tracemalloc` in bytes ("peak_memory", only with `trace_memory`)
+        and the peak resident set size of the process in bytes ("peak_rss").
+    """
+    # some stages modify their arguments, e.g. the counts of sampleTypes
+    traced_args = deepcopy((args, kwargs)) if trace_memory else None
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    metrics = {"wall_time" : time.perf_counter() - start}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func(*traced_args[0], **traced_args[1])
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        metrics["peak_memory"] = peak
+    metrics["peak_rss"] = peakRss()
+    return (result, metrics)
+
+def measureImport(statement = "from semasioFlow import sampleTypes", repeat = 5,
+                  heavy_modules = ["matplotlib", "pandas", "scipy", "tqdm", "networkx", "nephosem.core.graph"]):
+    """Measure the time it takes a fresh Python process to run an import statement.
+
+    This is what every process-pool worker and short script pays before doing any work.
+
+    Parameters
+    ----------
+    statement : str, default="from semasioFlow import sampleTypes"
+        Import statement to time.
+    repeat : int, default=5
+        Number of fresh processes to run; the median time is reported.
+    heavy_modules : list of str
+        Modules whose loading is reported.
+
+    Returns
+    -------
+    dict
+        Median wall time of the import in seconds ("wall_time"), number of modules loaded ("modules")
+        and the heavy modules among them ("heavy_modules").
+    """
+    script = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(json.dumps({'wall_time' : time.perf_counter() - start, 'modules' : sorted(sys.modules)}))"
+    )
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], env = env, check = True,
+                                capture_output = True, text = True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    times = sorted(x['wall_time'] for x in runs)
+    modules = runs[-1]['modules']
+    return {
+        "wall_time" : times[len(times)//2],
+        "modules" : len(modules),
+        "heavy_modules" : [x for x in heavy_modules if x in modules]
+    }
+
+def checkPrecision(reference, approximation, k = 5):
+    """Compare the cosine similarities between tokens in two versions of a matrix, e.g. float64 and float32.
+
+    Parameters
+    ----------
+    reference : :class:`~nephosem.TypeTokenMatrix`
+        Matrix computed at full precision, e.g. the output of :func:`~semasioFlow.socmodels.createSoc`.
+    approximation : :class:`~nephosem.TypeTokenMatrix`
+        The same matrix computed with another `dtype`; its similarities are computed in that type.
+    k : int, default=5
+        Number of nearest neighbours to compare.
+
+    Returns
+    -------
+    dict
+        Maximum absolute ("max_abs_error") and relative ("max_rel_error") difference between the similarities
+        and mean overlap (Jaccard) between the `k` nearest neighbours of each token ("neighbour_agreement").
+    """
+    import numpy as np
+    from scipy import sparse
+
+    def cosines(mtx, dtype):
+        X = mtx.matrix.toarray() if sparse.issparse(mtx.matrix) else np.asarray(mtx.matrix)
+        X = X.astype(dtype)
+        norms = np.linalg.norm(X, axis = 1)
+        norms[norms == 0] = 1
+        X = X / norms[:, None]
+        sims = X @ X.T
+        np.fill_diagonal(sims, -np.inf)
+        return sims
+
+    approximation = approximation.submatrix(row = reference.row_items, col = reference.col_items)
+    old = cosines(reference, np.float64)
+    new = cosines(approximation, approximation.matrix.dtype).astype(np.float64)
+    off_diagonal = ~np.eye(len(old), dtype = bool)
+    errors = np.abs(old - new)[off_diagonal]
+    scale = np.abs(old)[off_diagonal]
+    k = min(k, len(old) - 1)
+    agreement = []
+    for i in range(len(old)):
+        old_nn = set(np.argsort(-old[i])[:k])
+        new_nn = set(np.argsort(-new[i])[:k])
+        agreement.append(len(old_nn & new_nn) / len(old_nn | new_nn) if k > 0 else 1.0)
+    return {
+        "max_abs_error" : float(errors.max()) if len(errors) else 0.0,
+        "max_rel_error" : float((errors[scale > 0] / scale[scale > 0]).max()) if (scale > 0).any() else 0.0,
+        "neighbour_agreement" : float(np.mean(agreement)) if agreement else 1.0
+    }
+
+def runBenchmarks(settings, output_dir, fname = None, corpus = {}, n_targets = 2, sample_size = 20,
+                  foc_win = [(3, 3), (5, 5)], lengths = ["FOC", 50], rel_macros = None, stages = None,
+                  trace_memory = True):
+    """Time the semasioFlow stages on a synthetic corpus.
+
+    Parameters
+    ----------
+    settings : dict
+        Configuration settings as designed from the `nephosem` workflow.
+        The corpus-related values are replaced by those of the synthetic corpus.
+    output_dir : str
+        Directory where the synthetic corpus, the intermediate matrices and the results are stored.
+    fname : str, optional
+        Filename to store the results in. By default it's "benchmark-{timestamp}.json" in `output_dir`.
+    corpus : dict, optional
+        Arguments for :func:`syntheticCorpus`.
+    n_targets : int, default=2
+        Number of target types, taken from the most frequent lemmas.
+    sample_size : int, default=20
+        Number of tokens to sample per target type.
+    foc_win : list of tuples, default=[(3, 3), (5, 5)]
+        Window sizes for `createBow`.
+    lengths : list, default=["FOC", 50]
+        Lengths for `createSoc`.
+    rel_macros : list of tuples, optional
+        LEMMAREL groups for `createRel`, as described there. If `None`, `createRel` is not run.
+        Otherwise, the corpus is generated with dependency annotation.
+    stages : list of str, optional
+        Names of the stages to run. By default, all of them.
+        The "precision" stage does not measure time or memory but compares `createSoc` models
+        computed as float32 with the float64 ones (see :func:`checkPrecision`).
+    trace_memory : bool, default=True
+        Whether to run each stage a second time to trace its memory use (see :func:`measureStage`).
+
+    Returns
+    -------
+    dict
+        Metadata of the run ("meta") and a list with the measurements of each stage ("results"),
+        as stored in `fname`.
+    """
+    from .load import loadVocab, loadColloc
+    from .sample import sampleTypes
+    from .focmodels import createBow, createRel
+    from .socmodels import targetPPMI, weightTokens, createSoc
+    from .contextwords import listContextwords
+    from .utils import booleanize, listCws
+    from nephosem import TypeTokenMatrix
+
+    all_stages = ['import', 'sampleTypes', 'createBow', 'createRel', 'weightTokens', 'createSoc', 'precision',
+                  'targetPPMI', 'listContextwords', 'booleanize', 'listCws']
+    stages = stages if stages else all_stages
+    if rel_macros is None and 'createRel' in stages:
+        logging.info("No `rel_macros` given: skipping createRel.")
+        stages = [x for x in stages if x != 'createRel']
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    fname = fname if fname else f"{output_dir}/benchmark-{timestamp}.json"
+
+    corpus_args = deepcopy(corpus)
+    corpus_args['dependencies'] = corpus_args.get('dependencies', rel_macros is not None)
+    fnames, corpus_settings = syntheticCorpus(f"{output_dir}/corpus", **corpus_args)
+    settings = deepcopy(settings)
+    settings.update(corpus_settings)
+    settings['output-path'] = output_dir
+    settings['outfile-encoding'] = settings.get('outfile-encoding', "utf-8")
+
+    results = []
+    def run(stage, func, *args, **kwargs):
+        if not stage in stages:
+            return None
+        logging.info("Benchmarking %s...", stage)
+        result, metrics = measureStage(func, *args, trace_memory = trace_memory, **kwargs)
+        metrics['stage'] = stage
+        results.append(metrics)
+        return result
+
+    if 'import' in stages:
+        logging.info("Benchmarking import...")
+        metrics = measureImport()
+        metrics['stage'] = 'import'
+        results.append(metrics)
+
+    # The frequency lists are fixtures, not benchmarks
+    vocab = loadVocab(f"{output_dir}/synthetic.nodefreq", settings, fnames = fnames)
+    colloc = loadColloc(f"{output_dir}/synthetic.wcmx.pac", settings, row_vocab = vocab, fnames = fnames)
+    targets = vocab.get_item_list(sorting = 'freq', descending = True)[:n_targets]
+    query = vocab.subvocab(targets)
+    type_name = "synthetic"
+    token_dir = f"{output_dir}/tokens/{type_name}"
+
+    sampled = run('sampleTypes', sampleTypes, {t : sample_size for t in targets}, list(fnames), settings)
+    tokenlist, fnameSample = sampled if sampled else (None, fnames)
+    bowdata = run('createBow', createBow, query, deepcopy(settings), type_name = type_name,
+                  fnames = fnameSample, tokenlist = tokenlist, foc_win = foc_win, output_dir = token_dir)
+    run('createRel', createRel, query, deepcopy(settings), rel_macros, type_name = type_name,
+        fnames = fnameSample, tokenlist = tokenlist, output_dir = token_dir)
+    ppmi = run('targetPPMI', targetPPMI, targets, {"freq" : vocab}, {"synthetic" : colloc},
+               type_name = type_name, output_dir = f"{output_dir}/registers")
+    if bowdata is not None:
+        weighting = {"no" : None, "weight" : ppmi} if ppmi is not None else {"no" : None}
+        weight_data = run('weightTokens', weightTokens, token_dir, weighting, bowdata)
+        if weight_data is not None:
+            soc_data = run('createSoc', createSoc, token_dir, weight_data['model_register'],
+                           {"all" : vocab}, lengths, colloc)
+        if weight_data is not None and soc_data is not None and 'precision' in stages:
+            # float32 models against the float64 ones, on the similarities used downstream
+            logging.info("Benchmarking precision...")
+            if not os.path.exists(f"{output_dir}/float32"):
+                logging.info("Creating directory: %s", f"{output_dir}/float32")
+                os.makedirs(f"{output_dir}/float32")
+            createSoc(token_dir, weight_data['model_register'], {"all" : vocab}, lengths, colloc,
+                      output_dir = f"{output_dir}/float32", dtype = "float32")
+            checks = [checkPrecision(TypeTokenMatrix.load(f"{token_dir}/{model}.tcmx.soc.pac"),
+                                     TypeTokenMatrix.load(f"{output_dir}/float32/{model}.tcmx.soc.pac"))
+                      for model in soc_data.index]
+            results.append({
+                "stage" : "precision",
+                "max_abs_error" : max(x["max_abs_error"] for x in checks),
+                "max_rel_error" : max(x["max_rel_error"] for x in checks),
+                "neighbour_agreement" : min(x["neighbour_agreement"] for x in checks)
+            })
+        tokens = TypeTokenMatrix.load(f"{token_dir}/{bowdata.index[0]}.tcmx.bool.pac")
+        boolean = run('booleanize', booleanize, tokens)
+        run('listCws', listCws, boolean if boolean is not None else tokens)
+    if tokenlist:
+        run('listContextwords', listContextwords, type_name, tokenlist, fnameSample, settings)
+
+    try:
+        import nephosem
+        nephosem_version = getattr(nephosem, "__version__", "unknown")
+    except ImportError:
+        nephosem_version = None
+    data = {
+        "meta" : {
+            "timestamp" : timestamp,
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "nephosem" : nephosem_version,
+            "corpus" : corpus_args,
+            "n_files" : len(fnames),
+            "n_targets" : n_targets,
+            "sample_size" : sample_size
+        },
+        "results" : results
+    }
+    with open(fname, "w") as f:
+        json.dump(data, f, indent = 2)
+    logging.info("Benchmark results of %s stages stored in %s.", len(results), fname)
+    return data
+
+def compareBenchmarks(fname1, fname2):
+    """Compare the results of two benchmark runs.
+
+    Parameters
+    ----------
+    fname1 : str
+        JSON file with the results of the baseline run, as stored by :func:`runBenchmarks`.
+    fname2 : str
+        JSON file with the results of the new run.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        One row per stage, with the measurements of both runs and the ratio between them
+        (above 1 means the new run is slower or takes more memory).
+    """
+    import pandas as pd
+
+    def loadResults(fname):
+        with open(fname, "r") as f:
+            results = json.load(f)["results"]
+        return pd.DataFrame(results).set_index("stage")
+
+    old = loadResults(fname1)
+    new = loadResults(fname2)
+    comparison = old.join(new, how = "outer", lsuffix = "_old", rsuffix = "_new")
+    for metric in old.select_dtypes("number").columns:
+        comparison[f"{metric}_ratio"] = comparison[f"{metric}_new"] / comparison[f"{metric}_old"]
+    return comparison
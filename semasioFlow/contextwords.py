@@ -1,10 +1,11 @@
-import re
 from tqdm import tqdm
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
 from nephosem import CorpusFormatter
-from nephosem.core.graph import SentenceGraph
+
+from .parsing import LineParser
 
 __all__ = ['listContextwords']
 
@@ -25,11 +26,25 @@ def sameSentence(here, target, delimiters):
     bool
         Whether the two words are in the same sentence, i.e. not separated by a delimiter.
     """
-    if len(delimiters) == 0:
-        return True
     start = min(here, target)
     end = max(here, target)
-    return not bool(sum([x in range(start, end) for x in delimiters]))
+    return not any(start <= x < end for x in delimiters)
+
+def sentenceIds(records):
+    """Number the sentences of a file, as delimited by the lines that are not tokens.
+
+    Parameters
+    ----------
+    records : :class:`~semasioFlow.parsing.ParsedLines`
+        Parsed lines of the file.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        One integer per line; two tokens are in the same sentence if they have the same number.
+        Each delimiter starts a new sentence.
+    """
+    return np.cumsum([not records[i] for i in range(len(records))])
 
 def listContextwords(type_name, tokenlist, fnames, settings, left_win = None, right_win = None):
     """Create dataframe with detail on context words of tokens.
@@ -62,6 +77,7 @@ def listContextwords(type_name, tokenlist, fnames, settings, left_win = None, ri
     right_win = right_win + 1 if right_win else settings['right-span'] + 1
     
     formatter = CorpusFormatter(settings)
+    parser = LineParser(settings)
     text_variables = formatter.global_columns
     useDep = formatter.edge_attr in text_variables
     cws = {}
@@ -70,16 +86,20 @@ def listContextwords(type_name, tokenlist, fnames, settings, left_win = None, ri
     for file in tqdm(fnames):
         tokens = [(int(tokid.split('/')[3])-1, tokid)
                   for tokid in tokenlist if tokid.split("/")[2] == Path(file).stem]
+        if len(tokens) == 0:
+            continue
         with open(file, 'r', encoding = settings['file-encoding']) as f:
             lines = [s.strip() for s in f.readlines()]
+        records = parser.parseLines(lines)
+        sentences = sentenceIds(records)
             
         for index, tokid in tokens:
             tokendict = basic_dict.copy()
             tokendict.update({'token_id' : tokid})
             span = range(max(0, index-left_win), min(index+right_win, len(lines)))
-            not_text_lines = [i for i in span if not formatter.match_line(lines[i])]
+            same_sentence = sentences[span.start:span.stop] == sentences[index]
             if useDep:
-                steps = {str(x['this']) : x for x in getSteps(lines, index, formatter)}
+                steps = {str(x['this']) : x for x in getSteps(lines, index, formatter, records)}
 
                 
             for i in span:
@@ -96,11 +116,11 @@ def listContextwords(type_name, tokenlist, fnames, settings, left_win = None, ri
                     'side' : side,
                     'position' : position
                 })
-                match = formatter.match_line(lines[i])
-                if match:
-                    text_values = {k:v for k, v in zip(text_variables, match.groups())}
-                    text_values['cw'] = formatter.get_type(match)
-                    ss = sameSentence(i, index, not_text_lines)
+                record = records[i]
+                if record:
+                    text_values = {k:v for k, v in zip(text_variables, record.groups)}
+                    text_values['cw'] = record.type
+                    ss = bool(same_sentence[i-span.start])
                     text_values['same_sentence'] = ss
                     matchdict = cwdict.copy()
                     matchdict.update(text_values)
@@ -108,7 +128,7 @@ def listContextwords(type_name, tokenlist, fnames, settings, left_win = None, ri
                         if dist == 0:
                             path_data = {'steps' : 0, 'path' : "#T", 'rep_path' : "#T"}
                         else:
-                            this_path = steps[str(getIdx(lines[i], formatter))]
+                            this_path = steps[str(_recordIdx(record))]
                             path_data = {k : v for k, v in this_path.items() if k in ['steps', 'path', 'rep_path']}
                         matchdict.update(path_data)
                     cws[cwid] = matchdict
@@ -225,11 +245,14 @@ def getIdx(line, formatter):
     -------
     int
     """
-    line_machine = formatter.line_machine
-    match = re.match(line_machine, line)
+    match = formatter.match_line(line)
     return int(formatter.get(match, 'id')) if match else 0.5
 
-def getSteps(text, target_idx, formatter):
+def _recordIdx(record):
+    """Like :func:`getIdx`, for an already parsed line."""
+    return int(record.get('id')) if record else 0.5
+
+def getSteps(text, target_idx, formatter, records = None):
     """Return paths between each context word and the target.
     
     Parameters
@@ -239,16 +262,19 @@ def getSteps(text, target_idx, formatter):
     target_idx : int
         Index of target token
     formatter : :class:`~nephosem.CorpusFormatter`
+    records : :class:`~semasioFlow.parsing.ParsedLines`, optional
+        The same lines, parsed, to avoid parsing them again for each target.
     
     Returns
     -------
     list of dict
     """
-    target_line = text[target_idx] # line corresponding to the target
-    target_lid = getIdx(target_line, formatter) # index of target within sentence
+    from nephosem.core.graph import SentenceGraph
+    lineIdx = (lambda i: _recordIdx(records[i])) if records is not None else (lambda i: getIdx(text[i], formatter))
+    target_lid = lineIdx(target_idx) # index of target within sentence
     
     ss = [(i+(target_idx-target_lid), x) for i, x in enumerate(text)
-          if getIdx(x, formatter)-target_lid == i-target_idx] # lines of the sentence of the target
+          if lineIdx(i)-target_lid == i-target_idx] # lines of the sentence of the target
     sent = SentenceGraph(sentence=ss, formatter=formatter)
     subset = [v for v, vitem in sent.nodes if v != target_lid] # nodes matching the target
     steps = []
@@ -1,15 +1,13 @@
 from copy import deepcopy
-from functools import reduce
 import pandas as pd
 import os.path
 from tqdm import tqdm
 import logging
 
 from nephosem import TokenHandler, TypeTokenMatrix # to generate frequency lists and matrices
-from nephosem.models.deprel import DepRelHandler
-from nephosem.specutils.mxutils import merge_two_matrices
 
-from .utils import booleanize
+from .utils import booleanize, castMatrix, mergeMatrices, matrixFingerprint
+from .profiling import Profiler
 
 __all__ = ['createBow', 'createRel', 'createPath', 'tokensFromMacro']
 
@@ -18,7 +16,7 @@ def createBow(query, settings, type_name = None,
               bound = { "match" : "<artikel>", "values" : [False]},
               tokenlist = None, dummy_sentbound = "<artikel>",
              suffix = ".tcmx.bool.pac",
-             output_dir = None):
+             output_dir = None, profile = None, groups = None, fingerprint = False, dtype = None):
     """Create multiple bag-of-words token-level models on a loop.
     
     Parameters
@@ -53,11 +51,29 @@ def createBow(query, settings, type_name = None,
         Directory where the matrices will be stored.
         By default it's a subdirectory `type_name` within the subdirectry "tokens"
         within `settings['output-path']`. If the directory does not exist it will be created.   
+    profile : bool, str or callable, optional
+        Whether and where to record time, memory and matrix sizes per model and phase
+        ("corpus_scan", "submatrix", "booleanize", "save"), see :class:`~semasioFlow.profiling.Profiler`.
+        The metrics are added to the register as columns starting with "prof\_".
+    groups : dict or bool, optional
+        Split the tokens of a multi-type query into separate outputs, while scanning the corpus only once.
+        The keys are type names and the values lists of items of `query`;
+        if `True`, each item is grouped under the part before its first "/".
+        Each group gets its own models and files, in a subdirectory named after it within `output_dir`
+        (by default the subdirectory "tokens" within `settings['output-path']`).
+    fingerprint : bool, default=False
+        Whether to add a "fingerprint" column with a hash of each matrix
+        (see :func:`~semasioFlow.utils.matrixFingerprint`), so that identical models
+        can be detected downstream by :func:`~semasioFlow.socmodels.weightTokens`.
+    dtype : str or numpy dtype, optional
+        Type of the values of the boolean matrices, e.g. "int8" or "float32"
+        (see :func:`~semasioFlow.utils.castMatrix`). By default, they are stored as integers.
         
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame or dict
         Register of model parameters: it has one row per model and the parameter settings as columns.
+        With `groups`, a dictionary with one register per type name.
         
     Note
     ----
@@ -66,40 +82,83 @@ def createBow(query, settings, type_name = None,
     
     default_settings = deepcopy(settings)
     foc_win = foc_win if foc_win else [(settings['left-span'], settings['right-span'])]
-    type_name = type_name if type_name else query.get_item_list()[0].split("/")[0]
-    output_dir = output_dir if output_dir else f"{settings['output-path']}/tokens/{type_name}/"
-    
-    if not os.path.exists(output_dir):
-        logging.info("Creating directory: %s", output_dir)
-        os.makedirs(output_dir)
+    outputs = _typeGroups(query, settings, type_name, output_dir, groups)
         
-    model_register = {}
+    registers = {name : {} for name in outputs}
+    profiler = Profiler(profile, stage = "createBow")
     
     window_boundaries = [(w, b) for w in foc_win for b in bound["values"]]
     for w, b in tqdm(window_boundaries):
         settings['left-span'] = w[0]
         settings['right-span'] = w[1]
         settings['separator-line-machine'] = bound["match"] if b else dummy_sentbound
-        tokhan = TokenHandler(query, settings=settings)
-        tokens = tokhan.retrieve_tokens(fnames = fnames)
-        for fp, pos_list in foc_pos.items():
-            cols = pos_list if len(pos_list) > 0 else tokens.col_items
-            rows = tokenlist if tokenlist else tokens.row_items
-            toks = booleanize(tokens.submatrix(row = rows, col = cols)).drop(axis = 0, n_nonzero = 0)
-            modelname = f"{type_name}.{'no' if not b else ''}bound{w[0]}-{w[1]}{fp}"
-            model_register[modelname] = {
-                "foc_base" : "BOW",
-                "foc_win" : f"{w[0]}-{w[1]}",
-                "foc_pos" : fp,
-                "bound" : b
-            }
-            filename = f"{output_dir}/{modelname}{suffix}"
-            toks.save(filename)
+        modelnames = {
+            (name, fp) : f"{name}.{'no' if not b else ''}bound{w[0]}-{w[1]}{fp}"
+            for name in outputs for fp in foc_pos
+        }
+        with profiler.phase(list(modelnames.values()), "corpus_scan"):
+            tokhan = TokenHandler(query, settings=settings)
+            tokens = tokhan.retrieve_tokens(fnames = fnames)
+        for name, (types, type_dir) in outputs.items():
+            rows = _filterTypes(tokenlist if tokenlist else tokens.row_items, types)
+            for fp, pos_list in foc_pos.items():
+                modelname = modelnames[(name, fp)]
+                cols = pos_list if len(pos_list) > 0 else tokens.col_items
+                with profiler.phase(modelname, "submatrix"):
+                    toks = tokens.submatrix(row = rows, col = cols)
+                with profiler.phase(modelname, "booleanize"):
+                    toks = _booleanTokens(toks, dtype).drop(axis = 0, n_nonzero = 0)
+                registers[name][modelname] = {
+                    "foc_base" : "BOW",
+                    "foc_win" : f"{w[0]}-{w[1]}",
+                    "foc_pos" : fp,
+                    "bound" : b
+                }
+                filename = f"{type_dir}/{modelname}{suffix}"
+                with profiler.phase(modelname, "save"):
+                    toks.save(filename)
+                profiler.matrix(modelname, toks, filename)
+                registers[name][modelname].update(profiler.columns(modelname))
+                if fingerprint:
+                    registers[name][modelname]["fingerprint"] = matrixFingerprint(toks)
             
     settings = default_settings
-    return pd.DataFrame(model_register).transpose()
+    return _registerOutput(registers, groups)
+
+def _typeGroups(query, settings, type_name = None, output_dir = None, groups = None):
+    """Map each output type name to the types it covers and the directory of its matrices.
+
+    Without `groups`, there is one output covering all the types of the query (`None`).
+    """
+    if not groups:
+        type_name = type_name if type_name else query.get_item_list()[0].split("/")[0]
+        output_dir = output_dir if output_dir else f"{settings['output-path']}/tokens/{type_name}/"
+        outputs = {type_name : (None, output_dir)}
+    else:
+        if groups is True:
+            groups = {}
+            for item in query.get_item_list():
+                groups.setdefault(item.split("/")[0], []).append(item)
+        parent_dir = output_dir if output_dir else f"{settings['output-path']}/tokens"
+        outputs = {name : (set(types), f"{parent_dir}/{name}/") for name, types in groups.items()}
+    for _, type_dir in outputs.values():
+        if not os.path.exists(type_dir):
+            logging.info("Creating directory: %s", type_dir)
+            os.makedirs(type_dir)
+    return outputs
 
-def tokensFromMacro(query, macros, settings, fnames = None, weight = 1):
+def _filterTypes(token_ids, types = None):
+    """Keep the token IDs (type/file/line) whose type is in `types`, or all of them if `types` is `None`."""
+    if types is None:
+        return token_ids
+    return [x for x in token_ids if x.rsplit("/", 2)[0] in types]
+
+def _registerOutput(registers, groups = None):
+    if not groups:
+        return pd.DataFrame(list(registers.values())[0]).transpose()
+    return {name : pd.DataFrame(register).transpose() for name, register in registers.items()}
+
+def tokensFromMacro(query, macros, settings, fnames = None, weight = 1, dtype = None):
     """Obtain dependency-based token-level model.
     
     Parameters
@@ -114,21 +173,25 @@ def tokensFromMacro(query, macros, settings, fnames = None, weight = 1):
         Path to list of filenames or list of filenames to search tokens in. Default is the full corpus.
     weight : int, default=1
         Constant to multiply the values for (for weighting mechanisms).
+    dtype : str or numpy dtype, optional
+        Type of the values of the matrix, e.g. "float32" (see :func:`~semasioFlow.utils.castMatrix`).
+        By default, the type resulting from the multiplication is kept.
         
     Returns
     -------
     res : :class:`~nephosem.TypeTokenMatrix`
         Token level boolean matrix.
     """
+    from nephosem.models.deprel import DepRelHandler
     dephan = DepRelHandler(settings, workers=4, targets=query, mode='token')
     dephan.read_templates(macros=macros)
 
     tokens = dephan.build_dependency(fnames=fnames)
-    return TypeTokenMatrix(tokens.matrix*weight, tokens.row_items, tokens.col_items)
+    return castMatrix(TypeTokenMatrix(tokens.matrix*weight, tokens.row_items, tokens.col_items), dtype)
 
 def createRel(query, settings, rel_macros, type_name = None,
               fnames = None, tokenlist = None, foc_filter = None,
-             suffix = ".tcmx.bool.pac", output_dir = None):
+             suffix = ".tcmx.bool.pac", output_dir = None, groups = None, fingerprint = False, dtype = None):
     """Create multiple LEMMAREL token-level models on a loop.
     
     Parameters
@@ -156,45 +219,52 @@ def createRel(query, settings, rel_macros, type_name = None,
         Directory where the matrices will be stored.
         By default it's a subdirectory `type_name` within the subdirectry "tokens"
         within `settings['output-path']`. If the directory does not exist it will be created.   
+    groups : dict or bool, optional
+        Split the tokens of a multi-type query into separate outputs, while parsing the corpus only once
+        per LEMMAREL group. See :func:`createBow`.
+    fingerprint : bool, default=False
+        Whether to add a "fingerprint" column with a hash of each matrix
+        (see :func:`~semasioFlow.utils.matrixFingerprint`), so that identical models
+        can be detected downstream by :func:`~semasioFlow.socmodels.weightTokens`.
+    dtype : str or numpy dtype, optional
+        Type of the values of the boolean matrices, e.g. "int8" or "float32"
+        (see :func:`~semasioFlow.utils.castMatrix`). By default, they are stored as integers.
         
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame or dict
         Register of model parameters: it has one row per model and the parameter settings as columns.
+        With `groups`, a dictionary with one register per type name.
         
     Note
     ----
     As a secondary effect, the function stores all the token-by-feature boolean matrices.    
     """
-    type_name = type_name if type_name else query.get_item_list()[0].split("/")[0]
-    output_dir = output_dir if output_dir else f"{settings['output-path']}/tokens/{type_name}/"
-    
-    if not os.path.exists(output_dir):
-        logging.info("Creating directory: %s", output_dir)
-        os.makedirs(output_dir)
-    
-    model_register = {}
+    outputs = _typeGroups(query, settings, type_name, output_dir, groups)
+    registers = {name : {} for name in outputs}
     
     for rel_name, macros in rel_macros:
         tokens = tokensFromMacro(query, macros, settings, fnames)
-        rows = tokenlist if tokenlist else tokens.row_items
         cols = foc_filter if foc_filter else tokens.col_items
+        for name, (types, type_dir) in outputs.items():
+            rows = _filterTypes(tokenlist if tokenlist else tokens.row_items, types)
+            toks = _booleanTokens(tokens.submatrix(row = rows, col = cols), dtype).drop(axis = 0, n_nonzero = 0)
         
-        toks = booleanize(tokens.submatrix(row = rows, col = cols)).drop(axis = 0, n_nonzero = 0)
-    
-        modelname = f"{type_name}.{rel_name}"
-        model_register[modelname] = {
-            "foc_base" : "LEMMAREL",
-            "LEMMAREL" : rel_name
-        }
-        filename = f"{output_dir}/{modelname}{suffix}"
-        toks.save(filename)
+            modelname = f"{name}.{rel_name}"
+            registers[name][modelname] = {
+                "foc_base" : "LEMMAREL",
+                "LEMMAREL" : rel_name
+            }
+            filename = f"{type_dir}/{modelname}{suffix}"
+            toks.save(filename)
+            if fingerprint:
+                registers[name][modelname]["fingerprint"] = matrixFingerprint(toks)
         
-    return pd.DataFrame(model_register).transpose()
+    return _registerOutput(registers, groups)
 
 def createPath(query, settings, path_macros, type_name = None,
               fnames = None, tokenlist = None, foc_filter = None,
-             suffix = ".tcmx.bool.pac", output_dir = None):
+             suffix = ".tcmx.bool.pac", output_dir = None, dtype = None, fingerprint = False):
     """Create multiple PATH token-level models on a loop.
     
     Parameters
@@ -223,6 +293,13 @@ def createPath(query, settings, path_macros, type_name = None,
         Directory where the matrices will be stored.
         By default it's a subdirectory `type_name` within the subdirectry "tokens"
         within `settings['output-path']`. If the directory does not exist it will be created.   
+    dtype : str or numpy dtype, optional
+        Type of the values of the weighted or boolean matrices, e.g. "float32"
+        (see :func:`~semasioFlow.utils.castMatrix`). By default, the types are not changed.
+    fingerprint : bool, default=False
+        Whether to add a "fingerprint" column with a hash of each matrix
+        (see :func:`~semasioFlow.utils.matrixFingerprint`), so that identical models
+        can be detected downstream by :func:`~semasioFlow.socmodels.weightTokens`.
         
     Returns
     -------
@@ -242,23 +319,19 @@ def createPath(query, settings, path_macros, type_name = None,
     
     model_register = {}
     
-    def mergeTwo(mat1, mat2):
-        shared_tokens = list(set(mat1.row_items).intersection(set(mat2.row_items)))
-        return merge_two_matrices(mat1.submatrix(row = shared_tokens), mat2.submatrix(row = shared_tokens))
-    
     for path_name, macros, weights in path_macros:
         raw_values = weights is None
         weights = weights if weights else [1 for _ in range(len(macros))]
         token_matrices = [
-            tokensFromMacro(query, macro, settings, fnames, weight)
+            tokensFromMacro(query, macro, settings, fnames, weight, dtype)
             for macro, weight in zip(macros, weights)
         ]
-        tokens = reduce(mergeTwo, token_matrices)
+        tokens = mergeMatrices(token_matrices)
         rows = tokenlist if tokenlist else tokens.row_items
         cols = foc_filter if foc_filter else tokens.col_items
         
         toks = tokens.submatrix(row = rows, col = cols).drop(axis = 1)
-        toks = booleanize(toks) if raw_values else toks
+        toks = _booleanTokens(toks, dtype) if raw_values else toks
     
         modelname = f"{type_name}.{path_name}"
         model_register[modelname] = {
@@ -267,5 +340,11 @@ def createPath(query, settings, path_macros, type_name = None,
         }
         filename = f"{output_dir}/{modelname}{suffix}"
         toks.save(filename)
+        if fingerprint:
+            model_register[modelname]["fingerprint"] = matrixFingerprint(toks)
         
     return pd.DataFrame(model_register).transpose()
+
+def _booleanTokens(mtx, dtype = None):
+    """Booleanize a token matrix with values of `dtype` (integers by default) and compact indices."""
+    return castMatrix(booleanize(mtx, dtype = dtype if dtype else int), dtype)
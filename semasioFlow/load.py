@@ -1,13 +1,16 @@
 import os
+import json
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from functools import reduce
+from multiprocessing import Pool
 import logging
 
 from nephosem import Vocab, TypeTokenMatrix
 from nephosem import ItemFreqHandler, ColFreqHandler
-from nephosem.core.graph import MacroGraph, PatternGraph
 
-__all__ = ['loadVocab', 'loadMacro', 'loadColloc', 'loadFocRegisters']
+__all__ = ['loadVocab', 'loadMacro', 'loadColloc', 'loadFocRegisters', 'loadStudyRegisters', 'updateVocab', 'updateColloc']
 
 def loadVocab(fname, settings, fnames = None):
     """Load an existing vocabulary or create one.
@@ -27,7 +30,8 @@ def loadVocab(fname, settings, fnames = None):
 
     Note
     ----
-    If the file does not exist, it creates it and stores it in the filename given.
+    If the file does not exist, it creates it and stores it in the filename given,
+    along with the list of corpus files it counted (see :func:`updateVocab`).
     """
     if os.path.exists(fname):
         logging.info("Loading existing vocabulary...")
@@ -37,7 +41,50 @@ def loadVocab(fname, settings, fnames = None):
         ifhan = ItemFreqHandler(settings = settings)
         vocab = ifhan.build_item_freq(fnames = fnames)
         vocab.save(fname, encoding = settings['outfile-encoding'])
+        _writeManifest(fname, _listFnames(fnames, settings))
         return vocab
+
+def updateVocab(fname, settings, fnames):
+    """Add the frequencies of new corpus files to an existing vocabulary.
+
+    Only the files that are not listed in the manifest stored next to the vocabulary
+    (`fname` + ".fnames") are counted; the manifest is then updated.
+
+    Parameters
+    ----------
+    fname : str
+        Path where the vocabulary is stored.
+    settings : dict
+        Settings for creating the vocabulary and to extract the encoding information.
+    fnames : str or list
+        Corpus file names, which may include files already counted.
+
+    Returns
+    -------
+    vocab : :class:`~nephosem.Vocab`
+
+    Note
+    ----
+    If the file does not exist, it is created with :func:`loadVocab`.
+    """
+    if not os.path.exists(fname):
+        return loadVocab(fname, settings, fnames = fnames)
+    done = _readManifest(fname)
+    new_fnames = _newFnames(_listFnames(fnames, settings), done)
+    vocab = Vocab.load(fname, encoding = settings['outfile-encoding'])
+    if len(new_fnames) == 0:
+        logging.info("No new files to add to the vocabulary.")
+        return vocab
+    logging.info("Adding %s new files to the vocabulary...", len(new_fnames))
+    ifhan = ItemFreqHandler(settings = settings)
+    delta = ifhan.build_item_freq(fnames = new_fnames)
+    counts = {x : vocab[x] for x in vocab.get_item_list()}
+    for x in delta.get_item_list():
+        counts[x] = counts.get(x, 0) + delta[x]
+    vocab = Vocab(counts)
+    vocab.save(fname, encoding = settings['outfile-encoding'])
+    _writeManifest(fname, new_fnames, append = True)
+    return vocab
     
 def loadMacro(templates_dir, graphml_name, macro_name):
     """Load patterns and templates to create dependency-based models.
@@ -57,12 +104,14 @@ def loadMacro(templates_dir, graphml_name, macro_name):
     -------
     list of :class:`~nephosem.core.graph.MacroGraph`
     """
+    from nephosem.core.graph import MacroGraph, PatternGraph
     graphml_fname = f"{templates_dir}/{graphml_name}.template.graphml"
     patterns = PatternGraph.read_graphml(graphml_fname)
     macro_fname = f"{templates_dir}/{macro_name}.target-feature-macro.xml"
     return MacroGraph.read_xml(macro_fname, patterns)
 
-def loadColloc(fname, settings, row_vocab = None, fnames = None, col_vocab = None):
+def loadColloc(fname, settings, row_vocab = None, fnames = None, col_vocab = None,
+               shards = None, workers = None, spill_dir = None):
     """Load an existing vocabulary or create one.
 
     Parameters
@@ -77,6 +126,13 @@ def loadColloc(fname, settings, row_vocab = None, fnames = None, col_vocab = Non
         Vocabulary for the rows of the collocation matrix.
     col_vocab : :class:`~nephosem.Vocab`, optional
         Vocabulary for the columns of the collocation matrix.
+    shards : int, optional
+        Number of chunks to split `fnames` into in order to build the matrix in parallel.
+        By default the matrix is built in one go.
+    workers : int, optional
+        Number of processes for a sharded build. Defaults to the number of CPUs.
+    spill_dir : str, optional
+        Directory where partial matrices of a sharded build are stored instead of kept in memory.
 
     Returns
     -------
@@ -85,7 +141,11 @@ def loadColloc(fname, settings, row_vocab = None, fnames = None, col_vocab = Non
 
     Note
     ----
-    If the file does not exist, it creates it and stores it in the filename given.
+    If the file does not exist, it creates it and stores it in the filename given,
+    along with the list of corpus files it counted (see :func:`updateColloc`).
+    A sharded build counts each chunk of files separately, aligns the partial counts
+    on the rows of `row_vocab` and the columns of `col_vocab` (or `row_vocab`)
+    and adds them up pairwise.
     """
     if os.path.exists(fname):
         logging.info("Loading existing collocation matrix...")
@@ -95,10 +155,176 @@ def loadColloc(fname, settings, row_vocab = None, fnames = None, col_vocab = Non
             logging.error("You need to specify a row vocabulary to create a new matrix")
             return
         logging.info("Creating new collocation matrix...")
-        cfhan = ColFreqHandler(settings = settings, row_vocab = row_vocab, col_vocab = col_vocab)
-        freqMTX = cfhan.build_col_freq(fnames = fnames)
+        if shards:
+            freqMTX = _shardedColloc(settings, row_vocab, fnames, col_vocab, shards, workers, spill_dir)
+        else:
+            cfhan = ColFreqHandler(settings = settings, row_vocab = row_vocab, col_vocab = col_vocab)
+            freqMTX = cfhan.build_col_freq(fnames = fnames)
         freqMTX.save(fname)
+        _writeManifest(fname, _listFnames(fnames, settings))
+        return freqMTX
+
+def updateColloc(fname, settings, row_vocab, fnames, col_vocab = None):
+    """Add the co-occurrences of new corpus files to an existing collocation matrix.
+
+    Only the files that are not listed in the manifest stored next to the matrix
+    (`fname` + ".fnames") are counted; the manifest is then updated.
+
+    Parameters
+    ----------
+    fname : str
+        Path where the collocation matrix is stored.
+    settings : dict
+        Settings for creating the matrix.
+    row_vocab : :class:`~nephosem.Vocab`
+        Vocabulary for the rows of the collocation matrix, e.g. the output of :func:`updateVocab`.
+    fnames : str or list
+        Corpus file names, which may include files already counted.
+    col_vocab : :class:`~nephosem.Vocab`, optional
+        Vocabulary for the columns of the collocation matrix.
+
+    Returns
+    -------
+    freqMTX : :class:`~nephosem.TypeTokenMatrix`
+        Type-level co-occurrence matrix matrix.
+
+    Note
+    ----
+    If the file does not exist, it is created with :func:`loadColloc`.
+    Only the rows and columns of the existing matrix are updated: items of `row_vocab` or `col_vocab`
+    that are missing from it are not added, since their co-occurrences in the files already counted are unknown.
+    Use :func:`loadColloc` with a new file name to include them.
+    """
+    if not os.path.exists(fname):
+        return loadColloc(fname, settings, row_vocab = row_vocab, fnames = fnames, col_vocab = col_vocab)
+    done = _readManifest(fname)
+    new_fnames = _newFnames(_listFnames(fnames, settings), done)
+    freqMTX = TypeTokenMatrix.load(fname)
+    if len(new_fnames) == 0:
+        logging.info("No new files to add to the collocation matrix.")
         return freqMTX
+    logging.info("Adding %s new files to the collocation matrix...", len(new_fnames))
+    cfhan = ColFreqHandler(settings = settings, row_vocab = row_vocab, col_vocab = col_vocab)
+    delta = cfhan.build_col_freq(fnames = new_fnames)
+    rows = list(freqMTX.row_items)
+    cols = list(freqMTX.col_items)
+    old_rows = set(rows)
+    old_cols = set(cols)
+    missing = len([x for x in delta.row_items if not x in old_rows]) + len([x for x in delta.col_items if not x in old_cols])
+    if missing > 0:
+        logging.warning("%s items are not in the existing collocation matrix and are not added.", missing)
+    old = _alignMatrix(freqMTX, rows, cols)
+    freqMTX = TypeTokenMatrix(old.matrix + _alignMatrix(delta, rows, cols).matrix, rows, cols)
+    freqMTX.save(fname)
+    _writeManifest(fname, new_fnames, append = True)
+    return freqMTX
+
+def _readManifest(fname):
+    """Read the list of corpus files included in an artifact."""
+    manifest = f"{fname}.fnames"
+    if not os.path.exists(manifest):
+        raise ValueError(f"No list of counted files ({manifest}) found: the artifact cannot be updated safely.")
+    with open(manifest, "r") as f:
+        return set(os.path.realpath(s.strip()) for s in f.readlines() if s.strip())
+
+def _writeManifest(fname, fnames, append = False):
+    """Store the list of corpus files included in an artifact next to it, as absolute paths."""
+    with open(f"{fname}.fnames", "a" if append else "w") as f:
+        for x in fnames:
+            f.write(os.path.realpath(x) + "\n")
+
+def _newFnames(fnames, done):
+    """Files that are not in the set of (absolute) paths `done`, each only once."""
+    new_fnames = {}
+    for x in fnames:
+        path = os.path.realpath(x)
+        if not path in done and not path in new_fnames:
+            new_fnames[path] = x
+    return list(new_fnames.values())
+
+def _listFnames(fnames, settings):
+    """Return corpus file names as a list, from a list, a file with a list or the corpus path."""
+    if fnames is None:
+        corpus_path = settings['corpus-path']
+        return [f"{corpus_path}/{x}" for x in sorted(os.listdir(corpus_path))]
+    if type(fnames) == str:
+        with open(fnames, "r") as f:
+            return [s.strip() for s in f.readlines() if s.strip()]
+    return list(fnames)
+
+def _alignMatrix(mtx, rows, cols):
+    """Reindex a matrix on fixed row and column items, dropping items not included."""
+    row_idx = {x : i for i, x in enumerate(rows)}
+    col_idx = {x : i for i, x in enumerate(cols)}
+    row_map = np.array([row_idx.get(x, -1) for x in mtx.row_items], dtype = np.int64)
+    col_map = np.array([col_idx.get(x, -1) for x in mtx.col_items], dtype = np.int64)
+    coo = sparse.coo_matrix(mtx.matrix)
+    new_rows = row_map[coo.row]
+    new_cols = col_map[coo.col]
+    keep = (new_rows >= 0) & (new_cols >= 0)
+    aligned = sparse.csr_matrix((coo.data[keep], (new_rows[keep], new_cols[keep])),
+                                shape = (len(rows), len(cols)))
+    return TypeTokenMatrix(aligned, list(rows), list(cols))
+
+def _loadPartial(partial):
+    return TypeTokenMatrix.load(partial) if type(partial) == str else partial
+
+def _storePartial(mtx, spill_fname):
+    if spill_fname is None:
+        return mtx
+    mtx.save(spill_fname)
+    return spill_fname
+
+def _collocShard(args):
+    """Count co-occurrences in a chunk of files and align them on the final rows and columns."""
+    settings, row_vocab, col_vocab, fnames, rows, cols, spill_fname = args
+    cfhan = ColFreqHandler(settings = settings, row_vocab = row_vocab, col_vocab = col_vocab)
+    # pool workers cannot start processes of their own: the shards are the parallelism
+    partial = _alignMatrix(cfhan.build_col_freq(fnames = fnames, multicore = False), rows, cols)
+    return _storePartial(partial, spill_fname)
+
+def _mergeShards(args):
+    """Add up two aligned partial matrices."""
+    partial1, partial2, spill_fname = args
+    mtx1 = _loadPartial(partial1)
+    mtx2 = _loadPartial(partial2)
+    merged = TypeTokenMatrix(mtx1.matrix + mtx2.matrix, mtx1.row_items, mtx1.col_items)
+    for partial in [partial1, partial2]:
+        if type(partial) == str:
+            os.remove(partial)
+    return _storePartial(merged, spill_fname)
+
+def _shardedColloc(settings, row_vocab, fnames, col_vocab, shards, workers = None, spill_dir = None):
+    """Build a collocation matrix by counting chunks of files in parallel and merging them in a tree."""
+    fnames = _listFnames(fnames, settings)
+    shards = max(1, min(shards, len(fnames)))
+    chunks = [fnames[i::shards] for i in range(shards)]
+    rows = row_vocab.get_item_list()
+    cols = col_vocab.get_item_list() if col_vocab is not None else rows
+    if spill_dir and not os.path.exists(spill_dir):
+        logging.info("Creating directory: %s", spill_dir)
+        os.makedirs(spill_dir)
+    spill = (lambda name: f"{spill_dir}/{name}.wcmx.pac") if spill_dir else (lambda name: None)
+
+    logging.info("Counting co-occurrences in %s shards...", len(chunks))
+    with Pool(processes = workers) as pool:
+        partials = pool.map(_collocShard, [
+            (settings, row_vocab, col_vocab, chunk, rows, cols, spill(f"shard{i}"))
+            for i, chunk in enumerate(chunks)
+        ])
+        level = 0
+        while len(partials) > 1:
+            level += 1
+            pairs = [
+                (partials[i], partials[i+1], spill(f"merge{level}-{i//2}"))
+                for i in range(0, len(partials)-1, 2)
+            ]
+            leftover = [partials[-1]] if len(partials) % 2 else []
+            partials = pool.map(_mergeShards, pairs) + leftover
+    freqMTX = _loadPartial(partials[0])
+    if type(partials[0]) == str:
+        os.remove(partials[0])
+    return freqMTX
 
 def loadFocRegisters(register_path, type_name, prefixes = ["bow", "rel", "path"]):
     """Load and combine first-order register dataframes.
@@ -130,3 +356,73 @@ def loadFocRegisters(register_path, type_name, prefixes = ["bow", "rel", "path"]
     registers = reduce(myMerge, registers)
     registers = registers.set_index("_model")
     return registers
+
+def loadStudyRegisters(register_path, type_names, prefixes = ["bow", "rel", "path"], cache = None, max_categories = 0.5):
+    """Load the first-order registers of several types and prefixes in one dataframe.
+
+    Unlike :func:`loadFocRegisters`, the registers are concatenated by model name instead of merged,
+    and repeated string values are stored as categories.
+
+    Parameters
+    ----------
+    register_path : str
+        Directory where the dataframes are stored, as `{type_name}.{prefix}-models.tsv`.
+    type_names : list of str
+        First parts of the file names.
+    prefixes : list of str
+        Infixes in the filenames. Missing combinations of type and prefix are skipped.
+    cache : str, optional
+        Path of a parquet file to store the combined register in (requires `pyarrow` or `fastparquet`).
+        The arguments it was built with are stored next to it (`cache` + ".json").
+        It is read instead of the registers as long as it is newer than all of them
+        and was built with the same arguments.
+    max_categories : float, default=0.5
+        Text columns with fewer distinct values than this proportion of rows are stored as categories.
+
+    Returns
+    -------
+    registers : :class:`pandas.DataFrame`
+        Combined register dataframes, indexed by "_model", with "_type" and "_prefix"
+        columns indicating the file each model comes from.
+    """
+    fnames = {(t, p) : f"{register_path}/{t}.{p}-models.tsv" for t in type_names for p in prefixes}
+    missing = [fname for fname in fnames.values() if not os.path.exists(fname)]
+    for fname in missing:
+        logging.warning("Register %s not found.", fname)
+    fnames = {k : v for k, v in fnames.items() if not v in missing}
+    if len(fnames) == 0:
+        raise ValueError(f"No registers found in {register_path}.")
+
+    params = {"type_names" : list(type_names), "prefixes" : list(prefixes), "max_categories" : max_categories,
+              "registers" : sorted(os.path.realpath(x) for x in fnames.values())}
+    if cache and os.path.exists(cache) and os.path.exists(f"{cache}.json"):
+        with open(f"{cache}.json", "r") as f:
+            cached_params = json.load(f)
+        if cached_params != params:
+            logging.info("Cached registers were built with other arguments: rebuilding...")
+        elif os.path.getmtime(cache) >= max(os.path.getmtime(x) for x in fnames.values()):
+            logging.info("Loading cached registers...")
+            return pd.read_parquet(cache)
+
+    registers = []
+    for (t, p), fname in fnames.items():
+        reg = pd.read_csv(fname, sep = "\t", index_col = "_model")
+        reg["_type"] = t
+        reg["_prefix"] = p
+        registers.append(reg)
+    registers = pd.concat(registers, sort = False)
+    duplicated = registers.index.duplicated()
+    if duplicated.any():
+        logging.warning("Models found in more than one register; only the first row is kept: %s",
+                        ", ".join(sorted(set(registers.index[duplicated]))))
+        registers = registers[~duplicated]
+    for col in registers.columns:
+        values = registers[col]
+        is_text = pd.api.types.is_string_dtype(values) or values.dtype == object
+        if is_text and not isinstance(values.dtype, pd.CategoricalDtype) and values.nunique() < max_categories * len(values):
+            registers[col] = values.astype("category")
+    if cache:
+        registers.to_parquet(cache)
+        with open(f"{cache}.json", "w") as f:
+            json.dump(params, f)
+    return registers
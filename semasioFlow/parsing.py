@@ -0,0 +1,116 @@
+import re
+
+__all__ = ['LineParser']
+
+class LineRecord:
+    """Values of a corpus line, as extracted by `settings['line-machine']`.
+
+    Parameters
+    ----------
+    groups : tuple of str
+        Values captured by the line machine, in the order of `settings['global-columns']`.
+    type : str
+        Type of the line, as defined by `settings['type']` (e.g. "lemma/pos").
+    columns : dict
+        Position of each column name in `groups`.
+    """
+    __slots__ = ('groups', 'type', '_columns')
+
+    def __init__(self, groups, type, columns):
+        self.groups = groups
+        self.type = type
+        self._columns = columns
+
+    def get(self, column):
+        """Value of a column, e.g. "lemma" or "id"."""
+        return self.groups[self._columns[column]]
+
+class LineParser:
+    """Parse corpus lines with a line machine compiled once.
+
+    When the line machine only captures plain tab-separated columns, i.e. `([^\\t]+)` groups
+    separated by tabs, lines are split instead of matched against the regular expression.
+
+    Parameters
+    ----------
+    settings : dict
+        Configuration settings as designed from the `nephosem` workflow,
+        with 'line-machine', 'global-columns' and 'type' values.
+    """
+    def __init__(self, settings):
+        self.line_machine = settings['line-machine']
+        self.pattern = re.compile(self.line_machine)
+        self.columns = {x.strip() : i for i, x in enumerate(settings['global-columns'].split(","))}
+        self.type_columns = [self.columns[x] for x in settings['type'].split("/")]
+        self._plain = self._plainColumns(self.line_machine)
+
+    @staticmethod
+    def _plainColumns(line_machine):
+        """Number of plain tab-separated columns in the line machine and whether it is anchored at the end."""
+        pattern = line_machine[1:] if line_machine.startswith("^") else line_machine
+        anchored = pattern.endswith("$")
+        pattern = pattern[:-1] if anchored else pattern
+        # the tabs may be written as such or escaped
+        pattern = pattern.replace("\\t", "\t")
+        column = "([^\t]+)"
+        n = (len(pattern) + 1) // (len(column) + 1)
+        return (n, anchored) if n > 0 and pattern == "\t".join([column] * n) else None
+
+    def parse(self, line):
+        """Parse a line.
+
+        Parameters
+        ----------
+        line : str
+            Line of the corpus, without the final newline.
+
+        Returns
+        -------
+        :class:`LineRecord` or None
+            `None` if the line does not match the line machine.
+        """
+        if self._plain:
+            n, anchored = self._plain
+            fields = line.split("\t")
+            if len(fields) < n or (anchored and len(fields) > n) or "" in fields[:n]:
+                return None
+            groups = tuple(fields[:n])
+        else:
+            match = self.pattern.match(line)
+            if not match:
+                return None
+            groups = match.groups()
+        return LineRecord(groups, "/".join(groups[i] for i in self.type_columns), self.columns)
+
+    def format(self, record, type_format):
+        """Type of a parsed line in another format, e.g. `settings['colloc']`."""
+        return "/".join(record.get(x) for x in type_format.split("/"))
+
+    def parseLines(self, lines):
+        """Parse lines lazily: each line is parsed at most once, when first accessed.
+
+        Parameters
+        ----------
+        lines : list of str
+
+        Returns
+        -------
+        :class:`ParsedLines`
+        """
+        return ParsedLines(lines, self)
+
+class ParsedLines:
+    """Sequence of :class:`LineRecord` (or `None`) for a list of lines, parsed on first access."""
+    def __init__(self, lines, parser):
+        self.lines = lines
+        self.parser = parser
+        self._records = [False] * len(lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        record = self._records[i]
+        if record is False:
+            record = self._records[i] = self.parser.parse(self.lines[i])
+        return record
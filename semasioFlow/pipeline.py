@@ -0,0 +1,72 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['prefetch', 'AsyncWriter']
+
+def prefetch(func, items, depth = 1):
+    """Apply a function to items in a background thread, a few items ahead of the consumer.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to each item, typically loading a file.
+    items : iterable
+    depth : int, default=1
+        Maximum number of results computed ahead; it caps the memory taken by results waiting to be used.
+        With 0, each result is computed when requested.
+
+    Yields
+    ------
+    The results of `func`, in the order of `items`.
+    """
+    if depth <= 0:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        queue = deque()
+        for item in items:
+            queue.append(executor.submit(func, item))
+            if len(queue) > depth:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+class AsyncWriter:
+    """Run write operations in a background thread, with a bounded number of pending writes.
+
+    Parameters
+    ----------
+    max_pending : int, default=1
+        Maximum number of writes waiting or running; further submissions wait until one is done.
+        With 0, writes run immediately in the calling thread.
+
+    Note
+    ----
+    Errors of the writes are raised by :meth:`submit` or :meth:`close`.
+    """
+    def __init__(self, max_pending = 1):
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers = 1) if max_pending > 0 else None
+        self.pending = deque()
+
+    def submit(self, func, *args, **kwargs):
+        if self.executor is None:
+            func(*args, **kwargs)
+            return
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(func, *args, **kwargs))
+
+    def close(self):
+        """Wait for all pending writes."""
+        while self.pending:
+            self.pending.popleft().result()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,165 @@
+import re
+import random
+import pandas as pd
+import logging
+
+from .parsing import LineParser
+
+__all__ = ['planGrid']
+
+def planGrid(query, settings, vocab, colloc, fnames = None, sample_files = 20,
+             foc_win = None, foc_pos = { "all" : []}, bound = { "match" : "<artikel>", "values" : [False]},
+             tokenlist = None, type_name = None, weighting = ["no"], soc_pos = None, lengths = [],
+             value_bytes = 8, index_bytes = 4, memory_budget = None, disk_budget = None, seed = 0):
+    """Estimate the size of the models of a `createBow` + `weightTokens` + `createSoc` grid before running it.
+
+    Token counts come from the vocabulary, the number of context words per token from a sample of the corpus
+    and the density of second-order vectors from the collocation matrix.
+    The estimates are meant as upper bounds, to detect configurations that will not fit.
+
+    Parameters
+    ----------
+    query : :class:`~nephosem.Vocab`
+        Types to collect tokens from, as in :func:`~semasioFlow.focmodels.createBow`.
+    settings : dict
+    vocab : :class:`~nephosem.Vocab`
+        Frequencies of the corpus.
+    colloc : :class:`~nephosem.TypeTokenMatrix`
+        Collocation matrix to be used as `socMTX` in :func:`~semasioFlow.socmodels.createSoc`.
+    fnames : str or list, optional
+        Path to list of filenames or list of filenames the tokens will be searched in.
+        Default is the full corpus.
+    sample_files : int, default=20
+        Number of files to read in order to estimate the number of context words per token.
+    foc_win, foc_pos, bound, tokenlist, type_name
+        As in :func:`~semasioFlow.focmodels.createBow`.
+    weighting : list or dict, default=["no"]
+        Names of the PPMI values, as the keys of `weighting` in :func:`~semasioFlow.socmodels.weightTokens`.
+    soc_pos : dict, optional
+        As in :func:`~semasioFlow.socmodels.createSoc`. If `None`, second-order models are not planned.
+    lengths : list
+        As in :func:`~semasioFlow.socmodels.createSoc`.
+    value_bytes : int, default=8
+        Bytes per stored value (4 for a "float32" `dtype`).
+    index_bytes : int, default=4
+        Bytes per sparse index.
+    memory_budget : int, optional
+        Available memory in bytes. Models whose estimated peak exceeds it are flagged.
+    disk_budget : int, optional
+        Available disk space in bytes. Models are flagged once the cumulative size of the output exceeds it.
+    seed : int, default=0
+        Seed for the selection of sample files.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        One row per model with its stage, the estimated number of tokens, columns and nonzero values,
+        the estimated peak memory and file size (in bytes), the cumulative size of the output
+        and whether the budgets are exceeded.
+    """
+    from .load import _listFnames
+
+    foc_win = foc_win if foc_win else [(settings['left-span'], settings['right-span'])]
+    type_name = type_name if type_name else query.get_item_list()[0].split("/")[0]
+    targets = set(query.get_item_list())
+    items = set(vocab.get_item_list())
+    n_tokens = len(tokenlist) if tokenlist else sum(vocab[x] for x in targets if x in items)
+    n_vocab = len(items)
+
+    fnames = _listFnames(fnames, settings)
+    sample = random.Random(seed).sample(fnames, min(sample_files, len(fnames)))
+    parser = LineParser(settings)
+    files = [_readTypes(fname, parser, settings, bound["match"]) for fname in sample]
+    if not any(x is not None and x[0] in targets for types in files for x in types):
+        logging.warning("None of the %s sampled files contains a target: the number of context words is estimated as 0.",
+                        len(sample))
+
+    n_rows, n_cols = colloc.matrix.shape
+    density = colloc.matrix.nnz / (n_rows * n_cols) if n_rows * n_cols > 0 else 0
+
+    def sparseBytes(rows, nnz):
+        return int(nnz * (value_bytes + index_bytes) + (rows + 1) * index_bytes)
+
+    plan = {}
+    for w in foc_win:
+        for b in bound["values"]:
+            for fp, pos_list in foc_pos.items():
+                per_token = _contextsPerToken(files, targets, w, b, set(pos_list) if len(pos_list) > 0 else None)
+                cols = min(len(pos_list) if len(pos_list) > 0 else n_vocab, int(n_tokens * per_token))
+                nnz = int(n_tokens * per_token)
+                focmodel = f"{type_name}.{'no' if not b else ''}bound{w[0]}-{w[1]}{fp}"
+                # booleanize() goes through a dense array of booleans and one of integers
+                plan[focmodel] = {
+                    "stage" : "createBow", "tokens" : n_tokens, "cols" : cols, "nnz" : nnz,
+                    "memory" : n_tokens * cols * (1 + 8) + sparseBytes(n_tokens, nnz),
+                    "disk" : sparseBytes(n_tokens, nnz)
+                }
+                for param in weighting:
+                    weightmodel = f"{focmodel}.PPMI{param}"
+                    plan[weightmodel] = {
+                        "stage" : "weightTokens", "tokens" : n_tokens, "cols" : cols, "nnz" : nnz,
+                        "memory" : 3 * sparseBytes(n_tokens, nnz),
+                        "disk" : sparseBytes(n_tokens, nnz)
+                    }
+                    if soc_pos is None:
+                        continue
+                    for sp, sp_vocab in soc_pos.items():
+                        for length in lengths:
+                            soc_cols = min(length, len(sp_vocab.get_item_list())) if type(length) == int else cols
+                            # a token vector is nonzero wherever any of its context words has a nonzero PPMI
+                            soc_density = 1 - (1 - density) ** max(per_token, 1)
+                            soc_nnz = int(n_tokens * soc_cols * soc_density)
+                            pmi_nnz = int(cols * soc_cols * density)
+                            plan[f"{weightmodel}.LENGTH{length}.SOCPOS{sp}"] = {
+                                "stage" : "createSoc", "tokens" : n_tokens, "cols" : soc_cols, "nnz" : soc_nnz,
+                                "memory" : sparseBytes(n_tokens, nnz) + 2 * sparseBytes(cols, pmi_nnz) + 2 * sparseBytes(n_tokens, soc_nnz),
+                                "disk" : sparseBytes(n_tokens, soc_nnz)
+                            }
+
+    plan = pd.DataFrame.from_dict(plan, orient = "index")
+    plan["cumulative_disk"] = plan["disk"].cumsum()
+    plan["exceeds_memory"] = plan["memory"] > memory_budget if memory_budget else False
+    plan["exceeds_disk"] = plan["cumulative_disk"] > disk_budget if disk_budget else False
+    for modelname in plan.index[plan["exceeds_memory"] | plan["exceeds_disk"]]:
+        logging.warning("Model %s is expected to exceed the %s budget.", modelname,
+                        "memory" if plan.loc[modelname, "exceeds_memory"] else "disk")
+    return plan
+
+def _readTypes(fname, parser, settings, separator):
+    """Types and context words (`settings['colloc']`) of the lines of a file, with `None` for the lines matching `separator`."""
+    separator = re.compile(separator)
+    colloc_format = settings.get('colloc', settings['type'])
+    types = []
+    with open(fname, "r", encoding = settings.get('file-encoding', 'utf-8')) as f:
+        for line in f:
+            line = line.strip()
+            if separator.match(line):
+                types.append(None)
+                continue
+            record = parser.parse(line)
+            if record:
+                types.append((record.type, parser.format(record, colloc_format)))
+    return types
+
+def _contextsPerToken(files, targets, window, bound, allowed = None):
+    """Average number of different context words in the windows of the targets in the sample."""
+    left, right = window
+    counts = []
+    for types in files:
+        if not bound:
+            types = [x for x in types if x is not None]
+        for i, x in enumerate(types):
+            if x is None or not x[0] in targets:
+                continue
+            span = []
+            for j in range(i-1, max(-1, i-left-1), -1):
+                if types[j] is None:
+                    break
+                span.append(types[j][1])
+            for j in range(i+1, min(len(types), i+right+1)):
+                if types[j] is None:
+                    break
+                span.append(types[j][1])
+            span = set(span) if allowed is None else set(span).intersection(allowed)
+            counts.append(len(span))
+    return sum(counts) / len(counts) if counts else 0
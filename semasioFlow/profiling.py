@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import platform
+import resource
+from contextlib import contextmanager
+
+__all__ = ['Profiler']
+
+def peakRss():
+    """Peak resident set size of the current process, in bytes."""
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if platform.system() == "Darwin" else rss * 1024
+
+class Profiler:
+    """Opt-in recorder of time, memory and matrix sizes per model and per phase.
+
+    Parameters
+    ----------
+    profile : bool, str or callable, optional
+        If falsy, nothing is recorded. If `True`, the metrics are only kept for the model registers.
+        If a string, it is taken to be the path to a JSON-lines file where each event is appended.
+        If a callable, it is called with each event (a dictionary) as argument.
+    stage : str, optional
+        Name of the function being profiled, added to each event.
+
+    Note
+    ----
+    The peak RSS is the peak of the process up to the end of the phase,
+    so it only grows within a run.
+    """
+    def __init__(self, profile = None, stage = None):
+        self.enabled = bool(profile)
+        self.log = profile if type(profile) == str else None
+        self.callback = profile if callable(profile) else None
+        self.stage = stage
+        self.records = {}
+
+    def emit(self, event):
+        event = dict(event, stage = self.stage)
+        if self.log:
+            with open(self.log, "a") as f:
+                f.write(json.dumps(event, default = str) + "\n")
+        if self.callback:
+            self.callback(event)
+
+    def _update(self, models, values):
+        models = [models] if type(models) == str else models
+        for model in models:
+            self.records.setdefault(model, {}).update(values)
+            self.emit(dict(values, model = model))
+
+    @contextmanager
+    def phase(self, models, phase):
+        """Time a phase of the computation of one or more models.
+
+        Parameters
+        ----------
+        models : str or list of str
+            Name(s) of the model(s) the phase contributes to.
+        phase : str
+            Name of the phase, e.g. "load", "association" or "save".
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._update(models, {
+                "phase" : phase,
+                f"prof_{phase}_time" : time.perf_counter() - start,
+                "prof_peak_rss" : peakRss()
+            })
+
+    def matrix(self, models, mtx, fname = None):
+        """Record the shape and number of nonzero values of a matrix and the size of its file.
+
+        Parameters
+        ----------
+        models : str or list of str
+            Name(s) of the model(s) the matrix belongs to.
+        mtx : :class:`~nephosem.TypeTokenMatrix`
+        fname : str, optional
+            File where the matrix has been stored.
+        """
+        if not self.enabled:
+            return
+        values = {
+            "phase" : "matrix",
+            "prof_shape" : f"{len(mtx.row_items)}x{len(mtx.col_items)}",
+            "prof_nnz" : int(mtx.matrix.nnz) if hasattr(mtx.matrix, "nnz") else int((mtx.matrix != 0).sum())
+        }
+        if fname and os.path.exists(fname):
+            values["prof_bytes"] = os.path.getsize(fname)
+        self._update(models, values)
+
+    def columns(self, model):
+        """Metrics of a model, to add as columns of a model register.
+
+        Parameters
+        ----------
+        model : str
+
+        Returns
+        -------
+        dict
+        """
+        return {k : v for k, v in self.records.get(model, {}).items() if k.startswith("prof_")}
@@ -1,11 +1,11 @@
 from pathlib import Path
+import re
 import random
 import numpy as np
 from tqdm import tqdm
-import re
+import logging
 
-from nephosem import CorpusFormatter, TokenHandler
-from nephosem.utils import save_concordance
+from .parsing import LineParser
 
 __all__ = ['sampleTypes']
 
@@ -24,13 +24,17 @@ def sampleTypes(selection, fnames, settings, oneperfile = True, concordance = No
         Whether only one token of each lemma can be extracted from the same file.
     concordance : str
         File name to store concordance. If `None`, then no concordance is generated.
+        The concordance is a tab-separated file with the token ID and the word forms of the left context,
+        the target and the right context, within `settings['left-span']` and `settings['right-span']`
+        and not crossing `settings['separator-line-machine']`, if given.
+        It is written while sampling, from the files already in memory.
 
     Returns
     -------
     tuple
         A list of token IDs and the list of files where they can be found. Not separated by type.
     """
-    formatter = CorpusFormatter(settings)
+    parser = LineParser(settings)
     if type(fnames) == str:
         with open(fnames, "r") as f:
             fnames = [s.strip() for s in f.readlines()]
@@ -41,39 +45,71 @@ def sampleTypes(selection, fnames, settings, oneperfile = True, concordance = No
     
     tokens = set()
     final_files = set()
+    conc = None
+    if concordance is not None:
+        separator = settings.get('separator-line-machine')
+        separator = re.compile(separator) if separator else None
+        conc = open(concordance, "w", encoding = settings.get('outfile-encoding', 'utf-8'))
+        conc.write("\t".join(["id", "left", "target", "right"]) + "\n")
     
-    for file in tqdm(fnames):
-        if sum(selection.values()) <= 0:
-            break
-        with Path(file).open() as f:
-            try:
-                txt = [x.strip() for x in f.readlines()]
-            except:
-                continue
-        txt = [(str(i+1), x) for i, x in enumerate(txt) if re.match(settings['line-machine'], x)]
-        findings = {
-            target_type : _find_type(txt, target_type, formatter)
-            for target_type in selection.keys() if selection[target_type] > 0
-        }
-        if len(findings) == 0:
-            continue
-        for target_type in findings.keys():
-            if len(findings[target_type]) == 0:
+    try:
+        for file in tqdm(fnames):
+            if sum(selection.values()) <= 0:
+                break
+            with Path(file).open() as f:
+                try:
+                    txt = [x.strip() for x in f.readlines()]
+                except:
+                    continue
+            findings = _find_types(txt, [t for t in selection.keys() if selection[t] > 0], parser)
+            if len(findings) == 0:
                 continue
-            found_tokens = [np.random.choice(findings[target_type])] if oneperfile else findings[target_type]
-            for token in found_tokens:
-                tid = f"{target_type}/{Path(file).stem}/{token}"
-                if not tid in tokens:
-                    selection[target_type] -= 1
-                    tokens.add(tid)
-                    final_files.add(file)
+            for target_type in findings.keys():
+                if len(findings[target_type]) == 0:
+                    continue
+                found_tokens = [np.random.choice(findings[target_type])] if oneperfile else findings[target_type]
+                for token in found_tokens:
+                    tid = f"{target_type}/{Path(file).stem}/{token}"
+                    if not tid in tokens:
+                        selection[target_type] -= 1
+                        tokens.add(tid)
+                        final_files.add(file)
+                        if concordance is not None:
+                            left, target, right = _kwic(txt, int(token)-1, parser, settings, separator)
+                            conc.write("\t".join([tid, left, target, right]) + "\n")
+    finally:
+        if conc is not None:
+            conc.close()
     if concordance is not None:
-        tokhan = TokenHandler(query, settings=settings)
-        tokens = tokhan.retrieve_tokens(fnames = list(final_files)).submatrix(row = list(tokens))
-        save_concordance(concordance, tokhan.type2toks, colloc_fmt='word')
-        logger.info(f"Concordance of {len(tokens)} tokens with window size of {settings['left-span']}-{settings['right-span']} stored in {concordance}.")
+        logging.info("Concordance of %s tokens with window size of %s-%s stored in %s.",
+                     len(tokens), settings['left-span'], settings['right-span'], concordance)
             
     return (list(tokens), list(final_files))
 
-def _find_type(txt, target_type, formatter):
-    return [x[0] for x in txt if formatter.get_type(formatter.match_line(x[1])) == target_type]
\ No newline at end of file
+def _find_types(txt, target_types, parser):
+    """Line numbers (as strings, starting at 1) of the lines of each target type, parsing each line once."""
+    findings = {target_type : [] for target_type in target_types}
+    for i, line in enumerate(txt):
+        record = parser.parse(line)
+        if record and record.type in findings:
+            findings[record.type].append(str(i+1))
+    return findings
+
+def _kwic(txt, index, parser, settings, separator = None):
+    """Word forms of the left context, the target and the right context of the token in line `index`."""
+    def word(record):
+        return record.get('word') if 'word' in parser.columns else record.type
+
+    def context(positions, span):
+        words = []
+        for i in positions:
+            if len(words) == span or (separator and separator.match(txt[i])):
+                break
+            record = parser.parse(txt[i])
+            if record:
+                words.append(word(record))
+        return words
+
+    left = context(range(index-1, -1, -1), settings['left-span'])
+    right = context(range(index+1, len(txt)), settings['right-span'])
+    return (" ".join(reversed(left)), word(parser.parse(txt[index])), " ".join(right))
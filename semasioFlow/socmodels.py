@@ -1,15 +1,21 @@
 import os
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from functools import reduce
+from multiprocessing import Pool
 import logging
 
 from nephosem import Vocab, TypeTokenMatrix
 from nephosem import compute_association, compute_distance
 from nephosem.specutils.mxcalc import compute_token_weights, compute_token_vectors
 
-from .utils import fullMerge, listCws, countCws
+from .utils import fullMerge, listCws, countCws, castMatrix, reduceDimensions, matrixFingerprint
+from .profiling import Profiler
+from .approx import ApproxColloc
+from .pipeline import prefetch, AsyncWriter
 
-__all__ = ['targetPPMI','weightTokens', 'createSoc']
+__all__ = ['targetPPMI','weightTokens', 'createSoc', 'tokenDistances', 'loadVectors']
 
 def targetPPMI(targets, vocabs, collocs, type_name = None, main_matrix = None, fname = None, output_dir = None):
     """Registers PPMI values of a target lemma(s) with all possible context words.
@@ -27,7 +33,9 @@ def targetPPMI(targets, vocabs, collocs, type_name = None, main_matrix = None, f
     collocs : dict
         Frequency matrices to extract raw co-occurrence frequency and PPMI information from;
         the keys are their names
-        and the values are :class:`~nephosem.TypeTokenMatrix`.
+        and the values are :class:`~nephosem.TypeTokenMatrix`
+        or :class:`~semasioFlow.approx.ApproxColloc` (see :func:`~semasioFlow.approx.approxColloc`).
+        For the latter, the maximum error of the PMI values is registered in an additional "pmi_err" column.
     type_name : str, optional
         Name of the type, prefix for file names.
     main_matrix : str, optional
@@ -56,10 +64,16 @@ def targetPPMI(targets, vocabs, collocs, type_name = None, main_matrix = None, f
         fname = f"{output_dir}/{type_name}.ppmi.tsv"
     
     for colloc_name, colloc in collocs.items():
-        nfreq = Vocab(colloc.sum(axis=1))
-        cfreq = Vocab(colloc.sum(axis=0))
-        subcolloc = colloc.submatrix(row = targets).drop(axis = 1, n_nonzero = 0)
-        pmi = compute_association(subcolloc, nfreq=nfreq, cfreq=cfreq, meas = 'pmi')
+        if isinstance(colloc, ApproxColloc):
+            subcolloc, pmi, pmi_err = colloc.association(targets)
+            errdf = pmi_err.dataframe.transpose()
+            errdf.columns = [f"pmi_err_{colloc_name}"] if len(errdf.columns) == 1 else [f"pmi_err_{colloc_name}_{x}" for x in errdf.columns]
+            dfs.append(errdf)
+        else:
+            nfreq = Vocab(colloc.sum(axis=1))
+            cfreq = Vocab(colloc.sum(axis=0))
+            subcolloc = colloc.submatrix(row = targets).drop(axis = 1, n_nonzero = 0)
+            pmi = compute_association(subcolloc, nfreq=nfreq, cfreq=cfreq, meas = 'pmi')
         if colloc_name == main_matrix:
             ppmi = pmi.copy().multiply(pmi > 0).drop(axis = 1, n_nonzero = 0)
         pmidf = pmi.dataframe.transpose()    
@@ -79,7 +93,8 @@ def targetPPMI(targets, vocabs, collocs, type_name = None, main_matrix = None, f
     return ppmi
 
 def weightTokens(token_dir, weighting, registers, output_dir = None,
-                input_suffix = ".tcmx.bool.pac", output_suffix = ".tcmx.weight.pac"):
+                input_suffix = ".tcmx.bool.pac", output_suffix = ".tcmx.weight.pac", profile = None,
+                dtype = None, dedupe = False, pipeline = 0):
     """Apply (or not) weighting to all current token-level matrices across multiple weighting values.
     
     It does store the matrices too.
@@ -99,6 +114,27 @@ def weightTokens(token_dir, weighting, registers, output_dir = None,
         Suffix of the filenames to load.
     output_suffix : str, default=".tcmx.weight.pac"
         Suffix of the filenames to save.
+    profile : bool, str or callable, optional
+        Whether and where to record time, memory and matrix sizes per model and phase
+        ("load", "association", "save"), see :class:`~semasioFlow.profiling.Profiler`.
+        The metrics are added to the model register as columns starting with "prof\_",
+        replacing those of earlier stages.
+    dtype : str or numpy dtype, optional
+        Type of the values of the loaded, weighting and stored matrices, e.g. "float32"
+        (see :func:`~semasioFlow.utils.castMatrix` for the loss of precision).
+        By default, the types are not changed.
+    dedupe : bool, default=False
+        Whether to weight and store identical input matrices only once.
+        Duplicates are detected with the "fingerprint" column of `registers`
+        or, if missing, by hashing the loaded matrices (see :func:`~semasioFlow.utils.matrixFingerprint`).
+        The models of a duplicate are not stored: their "alias_of" column names the model they are identical to.
+        Models that already have an "alias_of" value in `registers` are always treated as duplicates,
+        whatever the value of `dedupe`, since their input matrices do not exist.
+    pipeline : int, default=0
+        Number of input matrices to load ahead and of output matrices to write in the background,
+        so that reading and writing overlap with computation. With 0, models are loaded, computed
+        and saved one after the other. With a pipeline, the "save" phase of `profile` only measures
+        the wait for a free slot and the file sizes are not recorded.
        
     Returns
     -------
@@ -109,31 +145,49 @@ def weightTokens(token_dir, weighting, registers, output_dir = None,
     model_register = {}
     token_register = {}
     output_dir = output_dir if output_dir else token_dir
+    profiler = Profiler(profile, stage = "weightTokens")
     
-    for focmodel in registers.index:
-        input_name = f"{token_dir}/{focmodel}{input_suffix}"
-        tokens = TypeTokenMatrix.load(input_name)
-        for param, weightMTX in weighting.items():
-            modelname = f"{focmodel}.PPMI{param}"
-            model_register[modelname] = dict(registers.loc[focmodel])
-            model_register[modelname]["foc_pmi"] = param
-            output_name = f"{output_dir}/{modelname}{output_suffix}"
-            if not weightMTX:
-                tokweights = tokens.deepcopy()
-            else:
-                intersected = list(set(tokens.col_items).intersection(set(weightMTX.col_items)))
-                tokweights = compute_token_weights(
-                    tokens.submatrix(col = intersected),
-                    weightMTX.submatrix(col = intersected),
-                    booleanize = False
-                ).drop(axis = 0, n_nonzero = 0)
-            tokweights.save(output_name)
-            model_register[modelname]['tokens'] = len(tokweights.row_items)
-            model_register[modelname]['foc_context_words'] = len(tokweights.col_items)
-            token_register["_cws." + modelname] = listCws(tokweights)
-            token_register["_count." + modelname] = countCws(tokweights)
+    with AsyncWriter(pipeline) as writer:
+        for focmodel, source, tokens in _uniqueModels(registers, token_dir, input_suffix, dedupe, profiler,
+                                                      lambda x: [f"{x}.PPMI{param}" for param in weighting], pipeline):
+            modelnames = {param : f"{focmodel}.PPMI{param}" for param in weighting}
+            if source is not None:
+                for param, modelname in modelnames.items():
+                    original = f"{source}.PPMI{param}"
+                    model_register[modelname] = _aliasRow(registers, focmodel, model_register[original], original)
+                    model_register[modelname]["foc_pmi"] = param
+                    token_register["_cws." + modelname] = token_register["_cws." + original]
+                    token_register["_count." + modelname] = token_register["_count." + original]
+                continue
+            tokens = castMatrix(tokens, dtype)
+            for param, weightMTX in weighting.items():
+                modelname = modelnames[param]
+                model_register[modelname] = _stageRow(registers, focmodel)
+                model_register[modelname]["foc_pmi"] = param
+                output_name = f"{output_dir}/{modelname}{output_suffix}"
+                with profiler.phase(modelname, "association"):
+                    if not weightMTX:
+                        tokweights = tokens.deepcopy()
+                    else:
+                        intersected = list(set(tokens.col_items).intersection(set(weightMTX.col_items)))
+                        tokweights = compute_token_weights(
+                            tokens.submatrix(col = intersected),
+                            castMatrix(weightMTX.submatrix(col = intersected), dtype),
+                            booleanize = False
+                        ).drop(axis = 0, n_nonzero = 0)
+                    tokweights = castMatrix(tokweights, dtype)
+                with profiler.phase(modelname, "save"):
+                    writer.submit(tokweights.save, output_name)
+                profiler.matrix(modelname, tokweights, None if pipeline else output_name)
+                model_register[modelname].update(profiler.columns(modelname))
+                model_register[modelname]['tokens'] = len(tokweights.row_items)
+                model_register[modelname]['foc_context_words'] = len(tokweights.col_items)
+                _setFingerprint(model_register[modelname], tokweights, dedupe)
+                token_register["_cws." + modelname] = listCws(tokweights)
+                token_register["_count." + modelname] = countCws(tokweights)
+    order = [f"{focmodel}.PPMI{param}" for focmodel in registers.index for param in weighting]
     data = {
-        "model_register" : pd.DataFrame(model_register).transpose(),
+        "model_register" : pd.DataFrame({k : model_register[k] for k in order}).transpose(),
         "token_register" : pd.DataFrame(token_register)
     }    
     return data
@@ -141,7 +195,9 @@ def weightTokens(token_dir, weighting, registers, output_dir = None,
 def createSoc(token_dir, registers, soc_pos, lengths, socMTX,
               output_dir = None,
               input_suffix = ".tcmx.weight.pac", output_suffix = ".tcmx.soc.pac",
-             store_focdists = False):
+             store_focdists = False, profile = None, dtype = None,
+             svd_components = None, svd_suffix = ".tcmx.svd.pac", svd_seed = 0,
+             chunk_size = None, chunk_suffix = ".tcmx.soc.dat", dedupe = False, pipeline = 0):
     """Multiply token-by-feature matrix by its second-order matrix.
     
     It does store the matrices too.
@@ -166,42 +222,353 @@ def createSoc(token_dir, registers, soc_pos, lengths, socMTX,
     store_focdists : bool or str, default=False
         Whether to store the context-word distance matrix. If False, it doesn't;
         if True, it stores them in `output_dir`; if it's a string, it is taken to be the directory to store them in.
+    profile : bool, str or callable, optional
+        Whether and where to record time, memory and matrix sizes per model and phase
+        ("load", "submatrix", "association", "focdists", "matmul", "save", "svd"),
+        see :class:`~semasioFlow.profiling.Profiler`.
+        The metrics are added to the register as columns starting with "prof\_",
+        replacing those of earlier stages.
+    dtype : str or numpy dtype, optional
+        Type of the values of the PPMI and token-level matrices that are multiplied and stored, e.g. "float32"
+        (see :func:`~semasioFlow.utils.castMatrix` for the loss of precision).
+        By default, the types are not changed.
+    svd_components : int, optional
+        If given, the token vectors are also reduced to this number of dimensions
+        with a randomized truncated SVD (see :func:`~semasioFlow.utils.reduceDimensions`)
+        and stored as dense float32 matrices.
+    svd_suffix : str, default=".tcmx.svd.pac"
+        Suffix of the filenames of the reduced matrices.
+    svd_seed : int, default=0
+        Seed of the randomized SVD.
+    chunk_size : int, optional
+        If given, the token vectors are computed for this number of tokens at a time
+        and appended to a dense on-disk matrix (see :func:`loadVectors`),
+        so that memory use depends on `chunk_size` rather than on the number of tokens.
+        It cannot be combined with `svd_components`.
+    chunk_suffix : str, default=".tcmx.soc.dat"
+        Suffix of the filenames of the on-disk matrices, used instead of `output_suffix` when `chunk_size` is given.
+    dedupe : bool, default=False
+        Whether to compute and store the second-order models of identical input matrices only once,
+        as described in :func:`weightTokens`.
+    pipeline : int, default=0
+        Number of input matrices to load ahead and of output matrices to write in the background,
+        so that reading and writing overlap with computation. With 0, models are loaded, computed
+        and saved one after the other. With a pipeline, the "save" phase of `profile` only measures
+        the wait for a free slot and the file sizes are not recorded.
        
     Returns
     -------
     dict of pandas.dataframe
         A register with one row per model and all the parameter settings as columns.
+        With `svd_components`, it also includes the number of components ("svd_components")
+        and the proportion of variance they explain ("svd_explained_variance").
     """
+    if chunk_size and svd_components:
+        raise ValueError("`chunk_size` and `svd_components` cannot be combined.")
     model_register = {}
     output_dir = output_dir if output_dir else token_dir
     soc_pos = {k : v.get_item_list(sorting = 'freq', descending = True) for k, v in soc_pos.items()}
     nfreq = Vocab(socMTX.sum(axis=1))
     cfreq = Vocab(socMTX.sum(axis=0))
+    profiler = Profiler(profile, stage = "createSoc")
     
     soc_params = [(sp, length) for sp in soc_pos for length in lengths]
-    for focmodel in registers.index:
-        input_name = f"{token_dir}/{focmodel}{input_suffix}"
-        tokens = TypeTokenMatrix.load(input_name)
-        for sp, length in soc_params:
-            modelname = f"{focmodel}.LENGTH{length}.SOCPOS{sp}"
-            model_register[modelname] = dict(registers.loc[focmodel])
-            model_register[modelname]["soc_length"] = length
-            model_register[modelname]["soc_pos"] = sp
-            output_name = f"{output_dir}/{modelname}{output_suffix}"
+    with AsyncWriter(pipeline) as writer:
+        for focmodel, source, tokens in _uniqueModels(registers, token_dir, input_suffix, dedupe, profiler,
+                                                      lambda x: [f"{x}.LENGTH{length}.SOCPOS{sp}" for sp, length in soc_params],
+                                                      pipeline):
+            modelnames = {(sp, length) : f"{focmodel}.LENGTH{length}.SOCPOS{sp}" for sp, length in soc_params}
+            if source is not None:
+                for (sp, length), modelname in modelnames.items():
+                    original = f"{source}.LENGTH{length}.SOCPOS{sp}"
+                    model_register[modelname] = _aliasRow(registers, focmodel, model_register[original], original)
+                    model_register[modelname]["soc_length"] = length
+                    model_register[modelname]["soc_pos"] = sp
+                continue
+            tokens = castMatrix(tokens, dtype)
+            for sp, length in soc_params:
+                modelname = modelnames[(sp, length)]
+                model_register[modelname] = _stageRow(registers, focmodel)
+                model_register[modelname]["soc_length"] = length
+                model_register[modelname]["soc_pos"] = sp
+                output_name = f"{output_dir}/{modelname}{output_suffix}"
         
-            sp_list = soc_pos[sp]
-            soc_cols =  sp_list[:length] if type(length) == int else list(set(tokens.col_items).intersection(set(sp_list)))
+                sp_list = soc_pos[sp]
+                soc_cols =  sp_list[:length] if type(length) == int else list(set(tokens.col_items).intersection(set(sp_list)))
             
-            socMTX_sub = socMTX.submatrix(row = tokens.col_items, col = soc_cols)
-            soc_pmi = compute_association(socMTX_sub, nfreq=nfreq, cfreq=cfreq, meas = 'ppmi')
-            if store_focdists:
-                focdists_dir = store_focdists if type(store_focdists) == str else output_dir
-                if not os.path.exists(focdists_dir):
-                    logging.info("Creating directory: %s", focdists_dir)
-                    os.makedirs(focdists_dir)
-                focdists_fname = f"{focdists_dir}/{modelname}.wwmx.dist.csv"
-                compute_distance(soc_pmi).to_csv(focdists_fname)
-            tokvecs = compute_token_vectors(tokens, soc_pmi)
-            tokvecs.save(output_name)
-    return pd.DataFrame(model_register).transpose()          
-        
\ No newline at end of file
+                with profiler.phase(modelname, "submatrix"):
+                    socMTX_sub = socMTX.submatrix(row = tokens.col_items, col = soc_cols)
+                with profiler.phase(modelname, "association"):
+                    soc_pmi = castMatrix(compute_association(socMTX_sub, nfreq=nfreq, cfreq=cfreq, meas = 'ppmi'), dtype)
+                if store_focdists:
+                    focdists_dir = store_focdists if type(store_focdists) == str else output_dir
+                    if not os.path.exists(focdists_dir):
+                        logging.info("Creating directory: %s", focdists_dir)
+                        os.makedirs(focdists_dir)
+                    focdists_fname = f"{focdists_dir}/{modelname}.wwmx.dist.csv"
+                    with profiler.phase(modelname, "focdists"):
+                        compute_distance(soc_pmi).to_csv(focdists_fname)
+                if chunk_size:
+                    output_name = f"{output_dir}/{modelname}{chunk_suffix}"
+                    with profiler.phase(modelname, "matmul"):
+                        _chunkedVectors(tokens, soc_pmi, output_name, chunk_size, dtype)
+                    model_register[modelname].update(profiler.columns(modelname))
+                    model_register[modelname].pop("fingerprint", None)
+                    continue
+                with profiler.phase(modelname, "matmul"):
+                    tokvecs = castMatrix(compute_token_vectors(tokens, soc_pmi), dtype)
+                with profiler.phase(modelname, "save"):
+                    writer.submit(tokvecs.save, output_name)
+                profiler.matrix(modelname, tokvecs, None if pipeline else output_name)
+                _setFingerprint(model_register[modelname], tokvecs, dedupe)
+                if svd_components:
+                    with profiler.phase(modelname, "svd"):
+                        reduced, explained = reduceDimensions(tokvecs, svd_components, seed = svd_seed)
+                        writer.submit(reduced.save, f"{output_dir}/{modelname}{svd_suffix}")
+                    model_register[modelname]["svd_components"] = len(reduced.col_items)
+                    model_register[modelname]["svd_explained_variance"] = explained
+                model_register[modelname].update(profiler.columns(modelname))
+    order = [f"{focmodel}.LENGTH{length}.SOCPOS{sp}" for focmodel in registers.index for sp, length in soc_params]
+    return pd.DataFrame({k : model_register[k] for k in order}).transpose()
+
+def _registeredAlias(registers, model):
+    """Model that `model` is registered as identical to, if any."""
+    if not "alias_of" in registers.columns or pd.isna(registers.loc[model, "alias_of"]):
+        return None
+    return registers.loc[model, "alias_of"]
+
+def _uniqueModels(registers, token_dir, input_suffix, dedupe, profiler, outputs, pipeline = 0):
+    """Go through the models of a register, loading only the matrices that are not duplicates.
+
+    Yields the name of each model, the name of the model it is identical to (or `None`)
+    and its matrix (or `None` for duplicates). Models registered as aliases are never loaded,
+    since their matrices were not stored, and come last, so that their originals are always processed first.
+    With `dedupe`, new duplicates are looked for in the "fingerprint" column or by hashing the matrices.
+    With `pipeline`, up to that number of matrices are loaded ahead in a background thread.
+    """
+    aliases = [m for m in registers.index if _registeredAlias(registers, m) is not None]
+    # duplicates known from the register fingerprints are not loaded at all
+    registered = {}
+    models = []
+    for focmodel in [m for m in registers.index if not m in aliases]:
+        if dedupe and "fingerprint" in registers.columns and not pd.isna(registers.loc[focmodel, "fingerprint"]):
+            fp = registers.loc[focmodel, "fingerprint"]
+            models.append((focmodel, registered.get(fp), fp))
+            registered.setdefault(fp, focmodel)
+        else:
+            models.append((focmodel, None, None))
+    loaded = prefetch(lambda m: TypeTokenMatrix.load(f"{token_dir}/{m}{input_suffix}"),
+                      [m for m, source, _ in models if source is None], pipeline)
+    hashed = {}
+    for focmodel, source, fp in models:
+        if source is not None:
+            yield (focmodel, source, None)
+            continue
+        with profiler.phase(outputs(focmodel), "load"):
+            tokens = next(loaded)
+        if dedupe and fp is None:
+            fp = matrixFingerprint(tokens)
+            if fp in hashed:
+                yield (focmodel, hashed[fp], None)
+                continue
+            hashed[fp] = focmodel
+        yield (focmodel, None, tokens)
+    for focmodel in aliases:
+        yield (focmodel, _registeredAlias(registers, focmodel), None)
+
+def _stageRow(registers, focmodel):
+    """Register row of a model, without the metrics profiled in earlier stages."""
+    return {k : v for k, v in registers.loc[focmodel].items() if not k.startswith("prof_")}
+
+def _aliasRow(registers, focmodel, original_row, original):
+    """Register row of a model identical to `original`, without computing or storing it."""
+    row = _stageRow(registers, focmodel)
+    # the original was computed, the alias was not: its metrics are not copied
+    row.update({k : v for k, v in original_row.items()
+                if not k.startswith("prof_") and (not k in row or k in ["tokens", "foc_context_words"])})
+    # same fingerprint as the original, also when it has none
+    if "fingerprint" in original_row:
+        row["fingerprint"] = original_row["fingerprint"]
+    else:
+        row.pop("fingerprint", None)
+    row["alias_of"] = original
+    return row
+
+def _setFingerprint(row, mtx, dedupe):
+    """Replace the fingerprint of the input matrix in a register row with that of the output."""
+    if dedupe:
+        row["fingerprint"] = matrixFingerprint(mtx)
+    else:
+        row.pop("fingerprint", None)
+
+def _chunkedVectors(tokens, soc_pmi, fname, chunk_size, dtype = None):
+    """Compute token vectors a chunk of rows at a time and append them to a file."""
+    dtype = np.dtype(dtype if dtype else np.float32)
+    for sidecar in [fname, f"{fname}.rows", f"{fname}.cols", f"{fname}.dtype"]:
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+    with open(f"{fname}.dtype", "w") as f:
+        f.write(dtype.name + "\n")
+    cols = None
+    for start in range(0, len(tokens.row_items), chunk_size):
+        chunk = tokens.submatrix(row = tokens.row_items[start:start + chunk_size])
+        vecs = compute_token_vectors(chunk, soc_pmi)
+        if cols is None:
+            cols = list(vecs.col_items)
+            with open(f"{fname}.cols", "w") as f:
+                f.write("\n".join(cols) + "\n")
+        elif list(vecs.col_items) != cols:
+            # the raw values are only meaningful if all chunks share the columns of the first one
+            if set(vecs.col_items) != set(cols):
+                raise ValueError(f"The columns of the token vectors of {fname} differ between chunks.")
+            vecs = vecs.submatrix(col = cols)
+        values = vecs.matrix.toarray() if sparse.issparse(vecs.matrix) else np.asarray(vecs.matrix)
+        with open(fname, "ab") as f:
+            f.write(np.ascontiguousarray(values, dtype = dtype).tobytes())
+        with open(f"{fname}.rows", "a") as f:
+            f.write("".join(f"{x}\n" for x in vecs.row_items))
+
+def loadVectors(fname, dtype = None):
+    """Load token vectors stored in chunks by :func:`createSoc` as a memory-mapped matrix.
+    
+    Parameters
+    ----------
+    fname : str
+        Path to the matrix; the token IDs, column names and type of the values are stored next to it,
+        with the ".rows", ".cols" and ".dtype" extensions.
+    dtype : str or numpy dtype, optional
+        Type of the values, if it was not stored with the matrix (float32 by default).
+        A type stored in the ".dtype" file takes precedence.
+    
+    Returns
+    -------
+    :class:`~nephosem.TypeTokenMatrix`
+        Matrix with a read-only :class:`numpy.memmap` as values, which are only read from disk when accessed.
+    """
+    def readLines(sidecar):
+        if not os.path.exists(sidecar):
+            return []
+        with open(sidecar, "r") as f:
+            return [s.rstrip("\n") for s in f.readlines()]
+    rows = readLines(f"{fname}.rows")
+    cols = readLines(f"{fname}.cols")
+    stored = readLines(f"{fname}.dtype")
+    if stored:
+        if dtype is not None and np.dtype(dtype) != np.dtype(stored[0]):
+            logging.warning("%s stores %s values: the requested type %s is ignored.", fname, stored[0], dtype)
+        dtype = stored[0]
+    dtype = dtype if dtype else "float32"
+    if len(rows) == 0 or len(cols) == 0:
+        return TypeTokenMatrix(np.zeros((len(rows), len(cols)), dtype = dtype), rows, cols)
+    values = np.memmap(fname, dtype = dtype, mode = "r", shape = (len(rows), len(cols)))
+    return TypeTokenMatrix(values, rows, cols)
+        
+
+def tokenDistances(token_dir, registers, output_dir = None,
+                   input_suffix = ".tcmx.soc.pac", output_suffix = ".ttmx.dist.f32",
+                   block_size = 1000, workers = None):
+    """Compute and store cosine distances between the tokens of each second-order model.
+    
+    The distances are computed in blocks of rows over a process pool and written to
+    condensed float32 memory maps, so that memory use depends on `block_size` rather than
+    on the square of the number of tokens.
+    
+    Parameters
+    ----------
+    token_dir : str
+        Path to the directory where the token-level matrices are stored.
+    registers : :class:`pandas.DataFrame`
+        Register of model information, e.g. the output of :func:`createSoc`, with names of the models in the index.
+    output_dir : str, optional
+        Directory where the distances will be stored. Defaults to `token_dir`.
+    input_suffix : str, default=".tcmx.soc.pac"
+        Suffix of the filenames to load.
+        Matrices stored in chunks by :func:`createSoc` (not ending in ".pac") are read as memory maps.
+    output_suffix : str, default=".ttmx.dist.f32"
+        Suffix of the filenames to save. The token IDs are stored in the same order
+        in a file with the same name and the ".rows" extension.
+    block_size : int, default=1000
+        Number of rows computed at once by each process.
+    workers : int, optional
+        Number of processes. Defaults to the number of CPUs.
+       
+    Returns
+    -------
+    pandas.DataFrame
+        A register with one row per model, the number of tokens and the filename of the distances
+        (empty for models with less than two tokens).
+        Models registered as duplicates (with an "alias_of" value, see :func:`createSoc`)
+        are not computed again but get the filename of their original.
+        
+    Note
+    ----
+    The distances follow the order of :func:`scipy.spatial.distance.squareform`:
+    they can be read with `np.memmap(fname, dtype = "float32", mode = "r")`
+    and turned into a square matrix with `squareform()`.
+    """
+    model_register = {}
+    output_dir = output_dir if output_dir else token_dir
+    if not os.path.exists(output_dir):
+        logging.info("Creating directory: %s", output_dir)
+        os.makedirs(output_dir)
+    
+    aliases = [m for m in registers.index if _registeredAlias(registers, m) is not None]
+    for modelname in [m for m in registers.index if not m in aliases]:
+        input_name = f"{token_dir}/{modelname}{input_suffix}"
+        output_name = f"{output_dir}/{modelname}{output_suffix}"
+        rows = _tokenRows(input_name)
+        n = len(rows)
+        if n < 2:
+            logging.info("Model %s has less than two tokens: no distances computed.", modelname)
+            model_register[modelname] = {"tokens" : n, "dist_file" : None}
+            continue
+        with open(f"{output_name}.rows", "w") as f:
+            f.write("\n".join(rows) + "\n")
+        model_register[modelname] = {"tokens" : n, "dist_file" : output_name}
+        dists = np.memmap(output_name, dtype = np.float32, mode = "w+", shape = (n*(n-1)//2,))
+        del dists # the workers open it on their own
+        blocks = [(start, min(start + block_size, n)) for start in range(0, n-1, block_size)]
+        with Pool(processes = workers, initializer = _initDistances, initargs = (input_name, output_name)) as pool:
+            pool.map(_distanceBlock, blocks)
+    for modelname in aliases:
+        original = _registeredAlias(registers, modelname)
+        model_register[modelname] = dict(model_register[original], alias_of = original)
+    return pd.DataFrame({k : model_register[k] for k in registers.index}).transpose()
+
+_distance_data = {}
+
+def _loadTokens(fname):
+    return TypeTokenMatrix.load(fname) if fname.endswith(".pac") else loadVectors(fname)
+
+def _tokenRows(fname):
+    """Token IDs of a token matrix, without keeping its values in memory."""
+    if not fname.endswith(".pac"):
+        with open(f"{fname}.rows", "r") as f:
+            return [s.rstrip("\n") for s in f.readlines()]
+    return list(TypeTokenMatrix.load(fname).row_items)
+
+def _initDistances(input_name, output_name):
+    """Load a token matrix and cache its row norms in a worker process."""
+    X = _loadTokens(input_name).matrix
+    X = sparse.csr_matrix(X, dtype = np.float32) if sparse.issparse(X) else np.asarray(X, dtype = np.float32)
+    sq = X.multiply(X).sum(axis = 1) if sparse.issparse(X) else np.einsum('ij,ij->i', X, X)
+    norms = np.sqrt(np.asarray(sq, dtype = np.float32).ravel())
+    norms[norms == 0] = 1 # empty vectors end up at distance 1 from everything
+    n = X.shape[0]
+    _distance_data.update({
+        "X" : X, "norms" : norms, "n" : n,
+        "dists" : np.memmap(output_name, dtype = np.float32, mode = "r+", shape = (n*(n-1)//2,))
+    })
+
+def _distanceBlock(block):
+    """Write the cosine distances between a block of rows and all the following rows."""
+    start, end = block
+    X, norms, n, dists = [_distance_data[k] for k in ["X", "norms", "n", "dists"]]
+    products = X[start:end] @ X[start:].T
+    products = products.toarray() if sparse.issparse(products) else np.asarray(products)
+    sims = products / norms[start:end, None] / norms[None, start:]
+    block_dists = np.clip(1 - sims, 0, 2).astype(np.float32)
+    for i in range(start, end):
+        offset = n*i - i*(i+1)//2
+        dists[offset:offset + n-i-1] = block_dists[i-start, i-start+1:]
+    dists.flush()
@@ -1,14 +1,14 @@
+import hashlib
 import numpy as np
 from scipy import sparse
-import matplotlib.pyplot as plt
+from scipy.sparse.linalg import norm as sparse_norm
 import pandas as pd
 
 from nephosem import TypeTokenMatrix
-from nephosem.specutils.deputils import draw_labels
 
-__all__ = ['booleanize', 'listCws', 'countCws', 'plotPatterns', 'fullMerge']
+__all__ = ['booleanize', 'castMatrix', 'reduceDimensions', 'mergeMatrices', 'matrixFingerprint', 'listCws', 'countCws', 'plotPatterns', 'fullMerge']
 
-def booleanize(mtx, include_negative = True):
+def booleanize(mtx, include_negative = True, dtype = int):
     """Transform matrix into matrix of 1's and 0's.
 
     Parameters
@@ -16,6 +16,8 @@ def booleanize(mtx, include_negative = True):
     mtx : :class:`~nephosem.TypeTokenMatrix`
     include_negative : bool
         Whether negative values should be transformed to 1's.
+    dtype : str or numpy dtype, default=int
+        Type of the values of the new matrix.
 
     Returns
     -------
@@ -23,9 +25,150 @@ def booleanize(mtx, include_negative = True):
     """
     # For PPMI matrices, include_negative should be False
     boolean_array = mtx.matrix.toarray() != 0 if include_negative else mtx.matrix.toarray() > 0
-    boolean_sparse = sparse.csr_matrix(boolean_array.astype(np.int))
+    boolean_sparse = sparse.csr_matrix(boolean_array.astype(dtype))
     return TypeTokenMatrix(boolean_sparse, mtx.row_items, mtx.col_items).drop(axis = 1, n_nonzero = 0)
 
+def castMatrix(mtx, dtype = None):
+    """Change the type of the values of a matrix and shrink its sparse indices.
+
+    Parameters
+    ----------
+    mtx : :class:`~nephosem.TypeTokenMatrix`
+    dtype : str or numpy dtype, optional
+        Type of the values, e.g. "float32". If `None`, the matrix is returned unchanged.
+
+    Returns
+    -------
+    :class:`~nephosem.TypeTokenMatrix`
+
+    Note
+    ----
+    When a sparse matrix is small enough, its indices are also stored as 32-bit integers,
+    so that "float32" roughly halves the memory and disk use of a float64 matrix with int64 indices.
+    Float32 values keep about 7 significant digits, so exact comparisons with float64 results are unreliable.
+    The effect on the similarities between tokens and on their nearest neighbours can be measured
+    with :func:`~semasioFlow.benchmark.checkPrecision` (the "precision" stage of
+    :func:`~semasioFlow.benchmark.runBenchmarks`).
+    """
+    if dtype is None:
+        return mtx
+    matrix = mtx.matrix if mtx.matrix.dtype == np.dtype(dtype) else mtx.matrix.astype(dtype)
+    if sparse.issparse(matrix) and hasattr(matrix, "indptr"):
+        # never shrink the indices of the matrix of the caller
+        matrix = matrix.copy() if matrix is mtx.matrix else matrix
+        limit = np.iinfo(np.int32).max
+        if matrix.nnz < limit and max(matrix.shape) < limit:
+            matrix.indices = matrix.indices.astype(np.int32, copy = False)
+            matrix.indptr = matrix.indptr.astype(np.int32, copy = False)
+    return TypeTokenMatrix(matrix, mtx.row_items, mtx.col_items)
+
+def reduceDimensions(mtx, n_components, n_oversamples = 10, n_iter = 4, seed = 0):
+    """Reduce the columns of a matrix with a randomized truncated SVD.
+
+    Parameters
+    ----------
+    mtx : :class:`~nephosem.TypeTokenMatrix`
+        Sparse or dense matrix, e.g. second-order token vectors.
+    n_components : int
+        Number of dimensions to keep. It is capped by the size of the matrix.
+    n_oversamples : int, default=10
+        Additional random projections used to approximate the singular vectors.
+    n_iter : int, default=4
+        Number of power iterations, which improve the approximation for slowly decaying spectra.
+    seed : int, default=0
+        Seed of the random projections, so that the same input yields the same output.
+
+    Returns
+    -------
+    tuple
+        A :class:`~nephosem.TypeTokenMatrix` with the same rows and dense float32 values
+        for the components ("dim1", "dim2"...), and the proportion of the squared Frobenius norm of `mtx`
+        captured by them (the explained variance, without centering).
+    """
+    X = mtx.matrix.astype(np.float64) if sparse.issparse(mtx.matrix) else np.asarray(mtx.matrix, dtype = np.float64)
+    n_components = max(1, min(n_components, min(X.shape)))
+    rng = np.random.RandomState(seed)
+    Q = X @ rng.normal(size = (X.shape[1], min(n_components + n_oversamples, X.shape[1])))
+    Q, _ = np.linalg.qr(Q)
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(X.T @ Q)
+        Q, _ = np.linalg.qr(X @ Q)
+    B = np.asarray((X.T @ Q).T)
+    U, S, _ = np.linalg.svd(B, full_matrices = False)
+    U = Q @ U[:, :n_components]
+    S = S[:n_components]
+    total = sparse_norm(X)**2 if sparse.issparse(X) else np.linalg.norm(X)**2
+    explained = float((S**2).sum() / total) if total > 0 else 0.0
+    reduced = (U * S).astype(np.float32)
+    return (TypeTokenMatrix(reduced, mtx.row_items, [f"dim{i+1}" for i in range(n_components)]), explained)
+
+def mergeMatrices(matrices):
+    """Add up token-level matrices on their shared rows and all their columns.
+
+    Parameters
+    ----------
+    matrices : list of :class:`~nephosem.TypeTokenMatrix`
+
+    Returns
+    -------
+    :class:`~nephosem.TypeTokenMatrix`
+        Matrix with the rows shared by all the matrices (in the order of the first one)
+        and the union of their columns, with the sum of their values.
+    """
+    shared = set(matrices[0].row_items)
+    for mtx in matrices[1:]:
+        shared = shared.intersection(mtx.row_items)
+    rows = [x for x in matrices[0].row_items if x in shared]
+    row_idx = {x : i for i, x in enumerate(rows)}
+    col_idx = {}
+    for mtx in matrices:
+        for x in mtx.col_items:
+            col_idx.setdefault(x, len(col_idx))
+    data, new_rows, new_cols = [], [], []
+    for mtx in matrices:
+        row_map = np.array([row_idx.get(x, -1) for x in mtx.row_items], dtype = np.int64)
+        col_map = np.array([col_idx[x] for x in mtx.col_items], dtype = np.int64)
+        coo = sparse.coo_matrix(mtx.matrix)
+        keep = row_map[coo.row] >= 0
+        data.append(coo.data[keep])
+        new_rows.append(row_map[coo.row[keep]])
+        new_cols.append(col_map[coo.col[keep]])
+    # duplicate coordinates are summed when converting to csr
+    merged = sparse.coo_matrix(
+        (np.concatenate(data), (np.concatenate(new_rows), np.concatenate(new_cols))),
+        shape = (len(rows), len(col_idx))
+    ).tocsr()
+    return TypeTokenMatrix(merged, rows, list(col_idx.keys()))
+
+def matrixFingerprint(mtx):
+    """Hash the labels and nonzero values of a matrix.
+
+    Parameters
+    ----------
+    mtx : :class:`~nephosem.TypeTokenMatrix`
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-1 digest: two matrices with the same row and column items
+        (in the same order) and the same values get the same fingerprint.
+    """
+    digest = hashlib.sha1()
+    for items in [mtx.row_items, mtx.col_items]:
+        digest.update("\x1f".join(items).encode("utf-8"))
+        digest.update(b"\x1e")
+    if sparse.issparse(mtx.matrix):
+        matrix = sparse.csr_matrix(mtx.matrix, copy = True)
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        parts = [matrix.indptr.astype(np.int64), matrix.indices.astype(np.int64), matrix.data.astype(np.float64)]
+    else:
+        parts = [np.ascontiguousarray(mtx.matrix, dtype = np.float64)]
+    for part in parts:
+        digest.update(part.tobytes())
+    return digest.hexdigest()
+
 def listCws(tokens):
     """List the context words co-occurring with each token in a matrix.
 
@@ -65,6 +208,9 @@ def plotPatterns(macros):
         Can be obtained with SemasioFlow.load.loadMacro().
     
     """    
+    # imported here so that matplotlib is only loaded when plotting
+    import matplotlib.pyplot as plt
+    from nephosem.specutils.deputils import draw_labels
     plt.rcParams['figure.figsize'] = (20.0, 32.0)
     for i in range(len(macros)):
         plt.subplot(5, 2, i+1)